@@ -0,0 +1,139 @@
+import hashlib
+import inspect
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+import numpy
+
+# Analysis results kept between runs, one .npz per artifact named after a hash
+# of its inputs, its parameters, the source of the code computing it and CODE_VERSION.
+# Empty it with: python -m code.artifactCache invalidate [name]
+CACHE_DIRECTORY = Path("./.cache/artifacts")
+
+# Oldest used artifacts are deleted past this size.
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+# Bump it whenever code not given to cached_arrays() changes the results,
+# every artifact computed before is then ignored.
+CODE_VERSION = 3
+
+_lock = threading.Lock()
+
+
+def array_hash(array) -> str:
+    """
+    Hash of the content of an array, to use as the input of an artifact.
+    """
+    array = numpy.ascontiguousarray(array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{array.dtype.str}{array.shape}".encode())
+    digest.update(array.view(numpy.uint8))
+    return digest.hexdigest()
+
+
+def code_hash(*functions) -> str:
+    """
+    Hash of the source of the modules defining the functions (or classes),
+    so an artifact is computed again once the code computing it changes.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for module in sorted(
+        {inspect.getmodule(function) for function in functions}, key=str
+    ):
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+
+def artifact_key(name: str, inputs, parameters: dict, code=()) -> str:
+    description = json.dumps(
+        {
+            "name": name,
+            "inputs": list(inputs),
+            "parameters": parameters,
+            "code": code_hash(*code),
+            "version": CODE_VERSION,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+
+
+def cached_arrays(name: str, inputs, parameters: dict, compute, code=()):
+    """
+    Returns the arrays computed by compute(), from the disk if they were
+    already computed from the same inputs and parameters.
+
+    :param inputs: Hashes of the inputs (see array_hash())
+    :param parameters: Everything else changing the result, JSON-serializable
+    :param compute: Function returning a dictionary of arrays
+    :param code: Functions doing the computation, the artifact depends on
+        the source of their modules (see code_hash())
+    :return: Dictionary of arrays
+    """
+    key = artifact_key(name, inputs, parameters, code)
+    path = CACHE_DIRECTORY / f"{name}-{key}.npz"
+
+    if path.exists():
+        try:
+            with numpy.load(path, allow_pickle=False) as loaded:
+                arrays = {key: loaded[key] for key in loaded.files}
+            # Marks it as recently used for the eviction
+            os.utime(path)
+            return arrays
+        except (OSError, ValueError):
+            # Truncated or corrupted, computed again below
+            path.unlink(missing_ok=True)
+
+    arrays = compute()
+
+    CACHE_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(temporary, "wb") as file:
+        numpy.savez(file, **arrays)
+    os.replace(temporary, path)
+
+    evict()
+    return arrays
+
+
+def evict(max_bytes: int | None = None):
+    """
+    Deletes the least recently used artifacts until the cache fits in max_bytes.
+    """
+    if max_bytes is None:
+        max_bytes = MAX_CACHE_BYTES
+    with _lock:
+        artifacts = sorted(
+            CACHE_DIRECTORY.glob("*.npz"), key=lambda path: path.stat().st_mtime
+        )
+        total = sum(path.stat().st_size for path in artifacts)
+        for path in artifacts:
+            if total <= max_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
+
+
+def invalidate(name: str | None = None):
+    """
+    Deletes every artifact, or only the ones of the given name.
+    """
+    pattern = "*.npz" if name is None else f"{name}-*.npz"
+    deleted = 0
+    with _lock:
+        for path in CACHE_DIRECTORY.glob(pattern):
+            path.unlink(missing_ok=True)
+            deleted += 1
+    return deleted
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "invalidate":
+        print("usage: python -m code.artifactCache invalidate [name]")
+        sys.exit(1)
+    name = sys.argv[2] if len(sys.argv) > 2 else None
+    print(f"Deleted {invalidate(name)} artifacts from {CACHE_DIRECTORY}")
@@ -0,0 +1,287 @@
+import sys
+import tempfile
+import time
+import tracemalloc
+from code import dtypePolicy
+from code.guitar import build_guitar_pipeline
+from code.music import AMONG_US, NOTE_OFFSET, NOTES
+from code.pitchShift import resampling_ratio, shift_pitch_resample
+from code.rawSignals import get_guitar
+from code.realtime import BlockRenderer, NullSink, render_realtime
+from code.saveFigure import wait_for_plots
+from code.signalCache import clear_signal_cache
+from code.signalFFT import SignalFFT, clear_fft_cache
+from code.signalModifications import apply_absolute, apply_gain, moving_average
+from code.synthesizer import synthesize_harmonics
+from code.wavetable import Wavetable
+from code.wavSignal import WavSignal
+from code.wavWriter import write_wav
+from pathlib import Path
+
+import numpy
+
+# Run with: python -m code.benchmarks [name]
+
+# Histograms of the render times exported by benchmark_realtime(). They change
+# every run, so they go in build/ (ignored by git) rather than in graphs/.
+HISTOGRAM_DIRECTORY = Path("build/latency")
+
+
+def best_time(function, repeats: int = 5):
+    """
+    Shortest duration (in seconds) of a few calls to function,
+    the others being slowed down by whatever else ran at the same time.
+    """
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def peak_memory(function):
+    """
+    Most memory (in bytes) allocated at once during a call to function.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def harmonic_band_levels(samples, sampling_rate: int, fundamental: float, count=31):
+    """
+    Amplitude of the spectrum around each harmonic, summed over a band one
+    fundamental wide. A harmonic slightly out of tune stays in its band.
+    """
+    spectrum = numpy.abs(numpy.fft.rfft(samples * numpy.hanning(len(samples))))
+    frequencies = numpy.fft.rfftfreq(len(samples), 1 / sampling_rate)
+    band = numpy.round(frequencies / fundamental).astype(numpy.int64)
+    inside = (band >= 1) & (band <= count)
+    return numpy.sqrt(
+        numpy.bincount(band[inside], spectrum[inside] ** 2, minlength=count + 1)[1:]
+    )
+
+
+def get_guitar_instrument():
+    """
+    Model of the guitar, from the cached analysis. Only the stages it needs
+    run: nothing is plotted nor saved.
+    """
+    pipeline = build_guitar_pipeline()
+    return pipeline.run("instrument", workers=1)["instrument"]
+
+
+def benchmark_note_synthesis(notes=("C3", "A3", "C", "A", "B"), duration=1.0):
+    """
+    Additive synthesis against the wavetable, on notes of the guitar.
+    The error compares the energy around each harmonic of both notes
+    (see harmonic_band_levels()), relative to the additive one.
+    """
+    instrument = get_guitar_instrument()
+    fs = instrument.get_sampling_rate()
+    envelope = instrument.get_envelope()
+    stop = NOTE_OFFSET + int(duration * fs)
+    harmonics = (
+        instrument.get_frequencies(),
+        instrument.get_amplitudes(),
+        instrument.get_phases(),
+    )
+    wavetable = Wavetable(*harmonics, instrument.get_fundamental())
+
+    print(f"Note synthesis, {duration}s per note:")
+    print(f"\t{'note':<6}{'additive':>12}{'wavetable':>12}{'speedup':>10}{'error':>12}")
+    for name in notes:
+        k = NOTES[name] / instrument.get_fundamental()
+
+        def additive(k=k):
+            return synthesize_harmonics(*harmonics, envelope, fs, k, NOTE_OFFSET, stop)
+
+        def table(k=k):
+            return wavetable.synthesize(envelope, fs, k, NOTE_OFFSET, stop)
+
+        additive_time = best_time(additive)
+        table_time = best_time(table)
+        fundamental = NOTES[name]
+        reference = harmonic_band_levels(additive(), fs, fundamental)
+        levels = harmonic_band_levels(table(), fs, fundamental)
+        error_dB = 20 * numpy.log10(
+            numpy.linalg.norm(levels - reference) / numpy.linalg.norm(reference)
+        )
+        print(
+            f"\t{name:<6}{additive_time * 1000:>10.2f}ms{table_time * 1000:>10.2f}ms"
+            f"{additive_time / table_time:>9.1f}x{error_dB:>10.1f}dB"
+        )
+
+
+def benchmark_pitch_shift(
+    notes=("C3", "A3", "C", "A", "B"), max_denominators=(16, 48, 128)
+):
+    """
+    Resampling the note synthesized once, against synthesizing each note,
+    for a few limits on the denominator of the resampling ratio.
+    The pitch error is the largest one over the notes. The timbre error
+    compares the relative levels of the harmonics over the first second of
+    both notes: the resampled envelope being shorter, the levels themselves
+    always differ.
+    """
+    instrument = get_guitar_instrument()
+    fs = instrument.get_sampling_rate()
+    fundamental = instrument.get_fundamental()
+    envelope = instrument.get_envelope()
+    length = instrument.get_note_length()
+    harmonics = (
+        instrument.get_frequencies(),
+        instrument.get_amplitudes(),
+        instrument.get_phases(),
+    )
+    base_note = synthesize_harmonics(*harmonics, envelope, fs, 1, 0, length)
+    ratios = [NOTES[name] / fundamental for name in notes]
+
+    def additive():
+        return [
+            synthesize_harmonics(*harmonics, envelope, fs, k, 0, length) for k in ratios
+        ]
+
+    references = additive()
+    additive_time = best_time(additive, repeats=3)
+    print(f"Pitch shift of {len(notes)} notes of {length} samples:")
+    print(f"\t{'method':<16}{'time':>10}{'pitch':>12}{'timbre':>10}")
+    print(f"\t{'additive':<16}{additive_time * 1000:>8.1f}ms")
+
+    for max_denominator in max_denominators:
+
+        def resample(max_denominator=max_denominator):
+            return [shift_pitch_resample(base_note, k, max_denominator) for k in ratios]
+
+        # The filters are designed by the first call only
+        resampled = resample()
+        resample_time = best_time(resample, repeats=3)
+
+        pitch_error = 0.0
+        level_errors = []
+        for k, name, note, reference in zip(ratios, notes, resampled, references):
+            up, down = resampling_ratio(k, max_denominator)
+            pitch_error = max(pitch_error, abs(1200 * numpy.log2(down / up / k)))
+            window = slice(0, min(fs, len(note)))
+            levels = harmonic_band_levels(note[window], fs, NOTES[name])
+            reference = harmonic_band_levels(reference[window], fs, NOTES[name])
+            level_errors.append(
+                numpy.linalg.norm(
+                    levels / numpy.linalg.norm(levels)
+                    - reference / numpy.linalg.norm(reference)
+                )
+            )
+        level_error_dB = 20 * numpy.log10(max(level_errors))
+        print(
+            f"\t{f'resample /{max_denominator}':<16}{resample_time * 1000:>8.1f}ms"
+            f"{pitch_error:>7.2f}cents{level_error_dB:>8.1f}dB"
+        )
+
+
+def benchmark_realtime(
+    block_sizes=(64, 128, 256, 512, 1024),
+    music=AMONG_US,
+    directory=HISTOGRAM_DIRECTORY,
+):
+    """
+    Block rendering of a music at a few block sizes, as fast as possible.
+    The histograms of the render times are exported as .csv files in
+    directory, and plotted.
+    """
+    instrument = get_guitar_instrument()
+    print("Real-time rendering:")
+    results = {}
+    for method in ("wavetable", "additive"):
+        for block_size in block_sizes:
+            renderer = BlockRenderer(instrument, music, block_size, method=method)
+            stats = render_realtime(renderer, NullSink())
+            print(f"\t{method:<10}", end="")
+            stats.print_summary()
+            results[f"latency_{method}_{block_size}"] = stats
+
+    # Once every block is timed, the figures rendered in the background
+    # can't slow them down anymore
+    for name, stats in results.items():
+        stats.export_histogram(Path(directory) / f"{name}.csv")
+        stats.plot_histogram(name)
+    wait_for_plots()
+
+
+def dtype_stages(signal: WavSignal, directory, order: int):
+    """
+    Stages timed by benchmark_dtype(), on a signal loaded with the processing
+    type being measured. Loading and saving use directory.
+    """
+
+    def absolute():
+        apply_absolute(signal.view())
+
+    def fft():
+        clear_fft_cache()
+        SignalFFT(signal)
+
+    return {
+        "load": lambda: WavSignal(signal.get_path()),
+        "absolute": absolute,
+        "average": lambda: moving_average(signal.get_signal(), order),
+        "gain": lambda: apply_gain(signal.view(), 0.5),
+        "fft": fft,
+        "save": lambda: signal.save(directory),
+    }
+
+
+def benchmark_dtype(dtypes=("float64", "float32"), repetitions=64, order=2000):
+    """
+    Stages of the analysis with each processing type (see code.dtypePolicy),
+    on the guitar repeated to make a long recording: time and memory peak.
+    """
+    guitar = get_guitar()
+    samples = numpy.tile(guitar.get_signal(), repetitions)
+    fs = guitar.get_sampling_rate()
+    default = dtypePolicy.PROCESSING_DTYPE
+
+    print(f"Processing types, {len(samples)} samples:")
+    print(f"\t{'stage':<10}" + "".join(f"{dtype:>22}" for dtype in dtypes))
+    with tempfile.TemporaryDirectory() as directory:
+        path = f"{directory}/long.wav"
+        write_wav(path, fs, [samples])
+        results = {}
+        try:
+            for dtype in dtypes:
+                dtypePolicy.PROCESSING_DTYPE = numpy.dtype(dtype)
+                clear_signal_cache()
+                stages = dtype_stages(WavSignal(path), directory, order)
+                for stage, function in stages.items():
+                    results[stage, dtype] = (
+                        best_time(function, repeats=3),
+                        peak_memory(function),
+                    )
+        finally:
+            dtypePolicy.PROCESSING_DTYPE = default
+            clear_signal_cache()
+            clear_fft_cache()
+
+    for stage in dict.fromkeys(stage for stage, _ in results):
+        line = f"\t{stage:<10}"
+        for dtype in dtypes:
+            duration, memory = results[stage, dtype]
+            line += f"{duration * 1000:>10.1f}ms{memory / 2**20:>8.1f}MiB"
+        print(line)
+
+
+BENCHMARKS = {
+    "note_synthesis": benchmark_note_synthesis,
+    "pitch_shift": benchmark_pitch_shift,
+    "realtime": benchmark_realtime,
+    "dtype": benchmark_dtype,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
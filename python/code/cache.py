@@ -0,0 +1,66 @@
+from collections import OrderedDict
+
+
+class ByteBudgetCache:
+    """
+    Least recently used cache bounded by the amount of bytes it holds
+    instead of the amount of entries.
+    Give it the size of every value you put in it, the oldest entries
+    are dropped once the budget is exceeded.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        """
+        Returns the cached value, or None if the key isn't cached.
+        """
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        value, _ = self._entries[key]
+        return value
+
+    def put(self, key, value, size: int):
+        """
+        Adds a value to the cache. A value bigger than the whole
+        budget is never kept.
+        """
+        self.remove(key)
+        if size > self._max_bytes:
+            return
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self._max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def remove(self, key):
+        if key in self._entries:
+            _, size = self._entries.pop(key)
+            self._bytes -= size
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def set_max_bytes(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        while self._bytes > self._max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def get_size(self):
+        """
+        Amount of bytes currently held
+        """
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
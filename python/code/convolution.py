@@ -0,0 +1,383 @@
+import hashlib
+import threading
+from code.cache import ByteBudgetCache
+from code.dtypePolicy import get_processing_dtype, to_processing
+
+import numpy
+import scipy.fft
+
+# Below this many multiplications, the direct convolution is faster than any FFT.
+DIRECT_MAX_OPERATIONS = 1_000_000
+
+# Kernel spectra already computed, by kernel and FFT size.
+MAX_CACHED_BYTES = 128 * 1024 * 1024
+_cache = ByteBudgetCache(MAX_CACHED_BYTES)
+_lock = threading.Lock()
+
+
+def mode_bounds(length: int, kernel_length: int, mode: str):
+    """
+    First and last (excluded) indexes of the full convolution kept by
+    a "full", "same" or "valid" convolution, same as numpy.convolve.
+    """
+    shortest = min(length, kernel_length)
+    longest = max(length, kernel_length)
+    if mode == "full":
+        return 0, length + kernel_length - 1
+    if mode == "same":
+        first = (shortest - 1) // 2
+        return first, first + longest
+    if mode == "valid":
+        return shortest - 1, longest
+    raise ValueError(f"Unknown mode: {mode}")
+
+
+def kernel_spectrum(kernel, fft_size: int):
+    """
+    Real FFT of the kernel zero-padded to fft_size.
+    Cached, so a kernel used on many signals is only transformed once per size.
+    """
+    kernel = numpy.ascontiguousarray(to_processing(kernel))
+    key = (
+        hashlib.blake2b(kernel.view(numpy.uint8), digest_size=16).digest(),
+        len(kernel),
+        fft_size,
+    )
+    with _lock:
+        spectrum = _cache.get(key)
+    if spectrum is None:
+        spectrum = scipy.fft.rfft(kernel, n=fft_size)
+        spectrum.flags.writeable = False
+        with _lock:
+            _cache.put(key, spectrum, spectrum.nbytes)
+    return spectrum
+
+
+def choose_method(length: int, kernel_length: int):
+    """
+    Fastest way to convolve signals of these lengths:
+    "direct" for small ones, "overlap_add" when the signal is much longer
+    than the kernel, "fft" otherwise.
+    """
+    if length * kernel_length <= DIRECT_MAX_OPERATIONS:
+        return "direct"
+    if max(length, kernel_length) > 8 * min(length, kernel_length):
+        return "overlap_add"
+    return "fft"
+
+
+def convolve(signal, kernel, mode: str = "full", method: str = "auto"):
+    """
+    Convolution of a signal with a kernel (impulse response),
+    a drop-in replacement of numpy.convolve for long signals and kernels.
+
+    :param mode: "full", "same" or "valid", like numpy.convolve
+    :param method: "direct", "fft", "overlap_add" or "auto" to let
+        choose_method() decide from the lengths.
+    :return: Samples in the processing type (see code.dtypePolicy)
+    """
+    signal = to_processing(signal)
+    kernel = numpy.asarray(kernel, dtype=signal.dtype)
+    if method == "auto":
+        method = choose_method(len(signal), len(kernel))
+
+    first, last = mode_bounds(len(signal), len(kernel), mode)
+
+    if method == "direct":
+        return numpy.convolve(signal, kernel, mode=mode)
+
+    # The convolution is commutative, the longest one is the one cut in blocks.
+    if len(kernel) > len(signal):
+        signal, kernel = kernel, signal
+
+    if method == "fft":
+        full = _fft_convolve(signal, kernel)
+    elif method == "overlap_add":
+        full = _overlap_add_convolve(signal, kernel)
+    else:
+        raise ValueError(f"Unknown method: {method}")
+    return full[first:last]
+
+
+def _fft_convolve(signal, kernel):
+    full_length = len(signal) + len(kernel) - 1
+    fft_size = scipy.fft.next_fast_len(full_length, real=True)
+    spectrum = scipy.fft.rfft(signal, n=fft_size) * kernel_spectrum(kernel, fft_size)
+    return scipy.fft.irfft(spectrum, n=fft_size)[:full_length]
+
+
+def _overlap_add_convolve(signal, kernel):
+    convolver = Convolver(kernel)
+    full = numpy.zeros(len(signal) + len(kernel) - 1, dtype=signal.dtype)
+    block_size = convolver.get_block_size()
+    for start in range(0, len(signal), block_size):
+        block = convolver.convolve_block(signal[start : start + block_size])
+        full[start : start + len(block)] += block
+    return full
+
+
+class Convolver:
+    """
+    Convolves many blocks of samples with the same kernel, by overlap-add.
+    The spectrum of the kernel is only computed once.
+
+    stream() takes blocks of any size and yields as many filtered samples as
+    it's given, followed by the tail of the kernel once the blocks run out.
+    """
+
+    def __init__(self, kernel, block_size: int | None = None):
+        self._kernel = numpy.asarray(kernel, dtype=get_processing_dtype())
+        if block_size is None:
+            # About 4 times the kernel, where overlap-add is the most efficient
+            block_size = max(len(self._kernel) * 3, 1024)
+        self._block_size = block_size
+        self._spectra = {}
+
+    def get_block_size(self):
+        return self._block_size
+
+    def get_kernel(self):
+        return self._kernel
+
+    def convolve_block(self, block):
+        """
+        Full convolution of one block with the kernel.
+        """
+        block = to_processing(block)
+        full_length = len(block) + len(self._kernel) - 1
+        # Same FFT size for every block up to block_size, to reuse the kernel spectrum
+        fft_size = scipy.fft.next_fast_len(
+            max(len(block), self._block_size) + len(self._kernel) - 1, real=True
+        )
+        if fft_size not in self._spectra:
+            self._spectra[fft_size] = kernel_spectrum(self._kernel, fft_size)
+        spectrum = scipy.fft.rfft(block, n=fft_size) * self._spectra[fft_size]
+        return scipy.fft.irfft(spectrum, n=fft_size)[:full_length]
+
+    def stream(self, blocks):
+        """
+        Generator of the filtered blocks, the overlapping tails of the previous
+        blocks being added to the next ones.
+        """
+        tail = numpy.zeros(len(self._kernel) - 1, dtype=self._kernel.dtype)
+        for block in blocks:
+            filtered = self.convolve_block(block)
+            filtered[: len(tail)] += tail
+            yield filtered[: len(block)]
+            tail = filtered[len(block) :]
+        if len(tail) > 0:
+            yield tail
+
+
+class UniformPartitionedConvolver:
+    """
+    Convolution with a kernel, one fixed-size block at a time,
+    by uniformly partitioned overlap-save.
+
+    The kernel is cut in partitions of block_size samples whose spectra are
+    computed once. Every call to process() does one FFT and one inverse FFT
+    of 2 * block_size samples, plus one complex multiply-accumulate per
+    partition against the spectra of the previous input blocks (the
+    frequency-domain delay line), so its cost grows with the kernel length.
+    PartitionedConvolver chains a few of them for long kernels.
+
+    The output of a block is available as soon as the block is given, so the
+    algorithmic latency is one block (the time to gather it).
+    """
+
+    def __init__(self, kernel, block_size: int = 256):
+        kernel = numpy.asarray(kernel, dtype=get_processing_dtype())
+        self._block_size = block_size
+        partition_count = max(-(-len(kernel) // block_size), 1)
+
+        partitions = numpy.zeros((partition_count, block_size), dtype=kernel.dtype)
+        partitions.flat[: len(kernel)] = kernel
+        self._kernel_spectra = scipy.fft.rfft(partitions, n=2 * block_size, axis=1)
+
+        # Spectra of the last inputs, the newest at self._position
+        self._delay_line = numpy.zeros_like(self._kernel_spectra)
+        self._position = 0
+        self._input = numpy.zeros(2 * block_size, dtype=kernel.dtype)
+
+    def get_block_size(self):
+        return self._block_size
+
+    def get_partition_count(self):
+        return len(self._kernel_spectra)
+
+    def get_latency(self):
+        """
+        Algorithmic latency in samples.
+        """
+        return self._block_size
+
+    def reset(self):
+        self._delay_line[:] = 0
+        self._position = 0
+        self._input[:] = 0
+
+    def process(self, block):
+        """
+        Filters the next block_size input samples, returns block_size output samples.
+        """
+        block_size = self._block_size
+        if len(block) != block_size:
+            raise ValueError(f"Blocks must be {block_size} samples, got {len(block)}")
+
+        # Previous block followed by the new one
+        self._input[:block_size] = self._input[block_size:]
+        self._input[block_size:] = block
+
+        self._position = (self._position - 1) % len(self._delay_line)
+        self._delay_line[self._position] = scipy.fft.rfft(self._input)
+
+        # Partition p is applied to the input of p blocks ago, which is
+        # p rows after the newest one in the circular delay line.
+        newest = self._position
+        wrapped = len(self._delay_line) - newest
+        spectrum = numpy.einsum(
+            "pk,pk->k", self._delay_line[newest:], self._kernel_spectra[:wrapped]
+        ) + numpy.einsum(
+            "pk,pk->k", self._delay_line[:newest], self._kernel_spectra[wrapped:]
+        )
+
+        # Overlap-save: the first half is circular aliasing
+        return scipy.fft.irfft(spectrum, n=2 * block_size)[block_size:]
+
+    def stream(self, blocks):
+        """
+        Generator of the filtered blocks. The last block is zero-padded if
+        it's too short, then the kernel tail is yielded block by block.
+        """
+        block_size = self._block_size
+        for block in blocks:
+            if len(block) < block_size:
+                block = numpy.concatenate(
+                    [block, numpy.zeros(block_size - len(block), dtype=block.dtype)]
+                )
+            yield self.process(block)
+        silence = numpy.zeros(block_size, dtype=self._input.dtype)
+        for _ in range(self.get_partition_count()):
+            yield self.process(silence)
+
+
+# Partitions of each size in a PartitionedConvolver, before the size doubles.
+STAGE_PARTITIONS = 4
+
+
+class PartitionedConvolver:
+    """
+    Real-time convolution with a long kernel (like a reverb impulse response),
+    one fixed-size block at a time, by non-uniformly partitioned overlap-save.
+
+    The start of the kernel is cut in partitions of block_size samples, the
+    rest in partitions twice as long every STAGE_PARTITIONS partitions. Each
+    size is a UniformPartitionedConvolver (a stage) fed with blocks of its
+    own size, so a stage only runs once every (its size / block_size) calls
+    to process(), and its output is added to the samples due that many
+    blocks later: the start of its part of the kernel is far enough for it
+    to be ready in time. The average cost of a block grows with the
+    logarithm of the kernel length instead of the length itself, but the
+    blocks completing a long partition do all of its work at once, there's
+    no background thread to spread it.
+
+    The algorithmic latency is one block, like the uniform convolver.
+    """
+
+    def __init__(
+        self, kernel, block_size: int = 256, stage_partitions: int = STAGE_PARTITIONS
+    ):
+        kernel = numpy.asarray(kernel, dtype=get_processing_dtype())
+        self._block_size = block_size
+        self._length = max(len(kernel), 1)
+
+        # Stages by increasing block size, with their first kernel sample
+        # and the input gathered since their last block.
+        self._stages = []
+        start = 0
+        size = block_size
+        while start < len(kernel) or not self._stages:
+            part = kernel[start : start + stage_partitions * size]
+            self._stages.append(
+                (
+                    UniformPartitionedConvolver(part, size),
+                    start,
+                    numpy.zeros(size, dtype=kernel.dtype),
+                )
+            )
+            start += stage_partitions * size
+            size *= 2
+
+        # Output of the stages for the next samples, circular: a stage writes
+        # up to its kernel start plus one block after the current block.
+        last_start = self._stages[-1][1]
+        self._output = numpy.zeros(last_start + block_size, dtype=kernel.dtype)
+        self._time = 0
+
+    def get_block_size(self):
+        return self._block_size
+
+    def get_partition_count(self):
+        return sum(stage.get_partition_count() for stage, _, _ in self._stages)
+
+    def get_stage_count(self):
+        return len(self._stages)
+
+    def get_latency(self):
+        """
+        Algorithmic latency in samples.
+        """
+        return self._block_size
+
+    def reset(self):
+        for stage, _, gathered in self._stages:
+            stage.reset()
+            gathered[:] = 0
+        self._output[:] = 0
+        self._time = 0
+
+    def process(self, block):
+        """
+        Filters the next block_size input samples, returns block_size output samples.
+        """
+        block_size = self._block_size
+        if len(block) != block_size:
+            raise ValueError(f"Blocks must be {block_size} samples, got {len(block)}")
+
+        time = self._time
+        for stage, start, gathered in self._stages:
+            size = stage.get_block_size()
+            filled = time % size
+            gathered[filled : filled + block_size] = block
+            if filled + block_size == size:
+                # Output of the stage input started at time - filled,
+                # delayed by the start of its part of the kernel.
+                self._add(time - filled + start, stage.process(gathered))
+
+        index = time % len(self._output)
+        filtered = self._output[index : index + block_size].copy()
+        self._output[index : index + block_size] = 0
+        self._time += block_size
+        return filtered
+
+    def _add(self, time, samples):
+        index = time % len(self._output)
+        head = min(len(samples), len(self._output) - index)
+        self._output[index : index + head] += samples[:head]
+        self._output[: len(samples) - head] += samples[head:]
+
+    def stream(self, blocks):
+        """
+        Generator of the filtered blocks. The last block is zero-padded if
+        it's too short, then the kernel tail is yielded block by block.
+        """
+        block_size = self._block_size
+        for block in blocks:
+            if len(block) < block_size:
+                block = numpy.concatenate(
+                    [block, numpy.zeros(block_size - len(block), dtype=block.dtype)]
+                )
+            yield self.process(block)
+        silence = numpy.zeros(block_size, dtype=self._output.dtype)
+        for _ in range(-(-self._length // block_size)):
+            yield self.process(silence)
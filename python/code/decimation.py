@@ -0,0 +1,56 @@
+import matplotlib.pyplot as plt
+import numpy
+
+# Amount of buckets a plotted line is reduced to: the width in pixels of an
+# exported 16 inches figure at 100 dpi. Each bucket keeps its min and its max.
+PLOT_RESOLUTION = 1600
+
+
+def decimate_for_plot(x, y, resolution: int = PLOT_RESOLUTION):
+    """
+    Reduces a line to at most 2 * resolution points without changing how it looks.
+
+    The samples are cut in resolution buckets and only the lowest and the
+    highest sample of each bucket are kept, in their original order. Every
+    peak is still drawn exactly, since a line drawn at that resolution only
+    shows the extremes of each column of pixels anyway.
+
+    Samples of several channels (samples x channels) are cut along the
+    samples, and the extremes of every channel are kept: the rows kept are
+    the same for all of them, so they still share x.
+
+    :param x: None to use the sample indexes, without building them for every sample.
+    :param resolution: None to keep every point.
+    """
+    y = numpy.asarray(y)
+    if resolution is None or len(y) <= 2 * resolution:
+        if x is None:
+            x = numpy.arange(len(y))
+        return numpy.asarray(x), y
+
+    bucket_size = -(-len(y) // resolution)
+    bucket_count = len(y) // bucket_size
+    full = bucket_count * bucket_size
+
+    buckets = y[:full].reshape(bucket_count, bucket_size, *y.shape[1:])
+    starts = (numpy.arange(bucket_count) * bucket_size).reshape(-1, *[1] * (y.ndim - 1))
+    kept = [
+        (starts + numpy.argmin(buckets, axis=1)).ravel(),
+        (starts + numpy.argmax(buckets, axis=1)).ravel(),
+    ]
+    if full < len(y):
+        kept.append(full + numpy.argmin(y[full:], axis=0).ravel())
+        kept.append(full + numpy.argmax(y[full:], axis=0).ravel())
+
+    indexes = numpy.unique(numpy.concatenate(kept))
+    if x is None:
+        return indexes, y[indexes]
+    return numpy.asarray(x)[indexes], y[indexes]
+
+
+def plot_decimated(x, y, *args, resolution: int = PLOT_RESOLUTION, **kwargs):
+    """
+    plt.plot() of the line reduced by decimate_for_plot().
+    """
+    x, y = decimate_for_plot(x, y, resolution)
+    return plt.plot(x, y, *args, **kwargs)
@@ -0,0 +1,76 @@
+import numpy
+
+# Type of the samples while they're processed. The recordings are read in
+# 16 bits: float32 keeps 24 bits of them, with half the memory (and half the
+# memory bandwidth) of float64. Set it to numpy.float64 before loading any
+# signal to process everything in float64 instead.
+PROCESSING_DTYPE = numpy.float32
+
+# Type of the samples of the .wav files written.
+OUTPUT_DTYPE = numpy.int16
+
+# Seed of the dither, so the same signal is always saved the same way.
+DITHER_SEED = 0
+
+
+def get_processing_dtype():
+    return numpy.dtype(PROCESSING_DTYPE)
+
+
+def get_processing_dtype_for(dtype):
+    """
+    Type to process samples read as dtype in: the processing type when it
+    holds every one of their values exactly (16 bits samples, float32 ones),
+    float64 otherwise, so 24 and 32 bits samples keep all their bits.
+    """
+    if numpy.can_cast(dtype, get_processing_dtype(), "safe"):
+        return get_processing_dtype()
+    return numpy.dtype(numpy.float64)
+
+
+def to_processing(samples):
+    """
+    Samples in the processing type, converted only if they aren't already.
+    Values aren't rescaled: 16 bits samples keep their amplitude. Samples it
+    can't hold exactly go to float64 instead (see get_processing_dtype_for()).
+    """
+    samples = numpy.asarray(samples)
+    return samples.astype(get_processing_dtype_for(samples.dtype), copy=False)
+
+
+def to_output(samples, dtype=OUTPUT_DTYPE, generator=None, dither: bool = True):
+    """
+    Samples rounded to an integer type (for .wav files), clipped to its range
+    instead of wrapping around.
+
+    Float samples get a triangular (TPDF) dither of one step peak first, so
+    the rounding error is noise independent of the signal rather than
+    distortion. Samples holding whole values already (a recording loaded and
+    saved untouched) have no rounding error, they're not dithered: they're
+    only clipped, like integer samples.
+
+    :param generator: numpy.random.Generator of the dither. Give the same one
+        for every block of a signal, so the noise doesn't repeat each block.
+    """
+    samples = numpy.asarray(samples)
+    dtype = numpy.dtype(dtype)
+    limits = numpy.iinfo(dtype)
+    if samples.dtype == dtype:
+        return samples
+    if numpy.issubdtype(samples.dtype, numpy.integer):
+        return numpy.clip(samples, limits.min, limits.max).astype(dtype)
+
+    # float64 holds every integer of 32 bits exactly, float32 those of 16 bits
+    work = numpy.float64 if dtype.itemsize > 2 else numpy.float32
+    rounded = samples.astype(work)
+    whole = numpy.rint(rounded)
+    if dither and not numpy.array_equal(whole, rounded):
+        if generator is None:
+            generator = numpy.random.default_rng(DITHER_SEED)
+        # Difference of two uniform noises, between -1 and 1 step
+        noise = generator.random(rounded.shape, dtype=work)
+        noise -= generator.random(rounded.shape, dtype=work)
+        rounded += noise
+        numpy.rint(rounded, out=whole)
+    numpy.clip(whole, limits.min, limits.max, out=whole)
+    return whole.astype(dtype)
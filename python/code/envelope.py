@@ -0,0 +1,249 @@
+from code.wavSignal import WavSignal
+
+import numpy
+
+# Samples between two breakpoints of an envelope decimated from a WavSignal.
+# The guitar's enveloppe still ripples at twice its fundamental, 8 keeps the
+# rendered musics within about -48 dB of the ones rendered from the samples.
+ENVELOPE_STEP = 8
+
+# Decay segments of a fitted ExponentialEnvelope.
+EXPONENTIAL_SEGMENTS = 24
+
+# Shortest decay segment, in samples. Only the first ones are that short.
+EXPONENTIAL_MIN_SEGMENT = 64
+
+# The attack starts at the last sample below this fraction of the peak.
+ATTACK_THRESHOLD = 0.05
+
+# Levels below this fraction of the peak are fitted as this fraction,
+# the log of the silent tail would otherwise drag the last segments down.
+EXPONENTIAL_FLOOR = 1e-4
+
+# Samples of decay kept per segment of an ExponentialEnvelope, more than a
+# block of real-time rendering. Longer spans are computed on every call, so
+# the decays kept stay below 32 kiB per segment.
+DECAY_CACHE_LENGTH = 4096
+
+
+class BreakpointEnvelope:
+    """
+    Envelope given by its value at a few samples (breakpoints),
+    linearly interpolated in between and silent after the last one.
+    """
+
+    def __init__(self, breakpoints, values):
+        self._breakpoints = numpy.asarray(breakpoints, dtype=numpy.float64)
+        self._values = numpy.asarray(values, dtype=numpy.float64)
+
+    @classmethod
+    def from_signal(cls, enveloppe: WavSignal, step: int = ENVELOPE_STEP):
+        """
+        Keeps one sample every step samples of the envelope, and its last one.
+        """
+        samples = numpy.asarray(enveloppe.get_signal(), dtype=numpy.float64)
+        breakpoints = numpy.unique(
+            numpy.append(numpy.arange(0, len(samples), step), len(samples) - 1)
+        )
+        return cls(breakpoints, samples[breakpoints])
+
+    @classmethod
+    def from_arrays(cls, breakpoints, values):
+        return cls(breakpoints, values)
+
+    def to_arrays(self):
+        return [self._breakpoints, self._values]
+
+    def get_breakpoints(self):
+        return self._breakpoints
+
+    def get_values(self):
+        return self._values
+
+    def get_length(self):
+        """
+        Amount of samples before the envelope goes silent
+        """
+        return int(self._breakpoints[-1]) + 1
+
+    def is_extendable(self):
+        """
+        Whether the envelope can be evaluated past get_length()
+        """
+        return False
+
+    def evaluate(self, start: int, stop: int):
+        """
+        Value of the envelope for every sample between start and stop.
+        """
+        return numpy.interp(
+            numpy.arange(start, stop), self._breakpoints, self._values, right=0.0
+        )
+
+
+class ExponentialEnvelope:
+    """
+    Parametric envelope: silent until the attack starts, a linear attack up
+    to the first breakpoint, then exponential decays between the next ones
+    (linear in dB). After the last breakpoint, the last decay goes on forever,
+    so it can be evaluated at any length.
+    A few dozen numbers instead of one value per sample.
+    """
+
+    def __init__(self, attack_start: int, breakpoints, levels, rates):
+        """
+        :param attack_start: Sample where the attack starts
+        :param breakpoints: Samples where each segment starts, the first one
+            is the end of the attack
+        :param levels: Value of the envelope at each breakpoint
+        :param rates: Decay of each segment, per sample (natural log)
+        """
+        self._attack_start = int(attack_start)
+        self._breakpoints = numpy.asarray(breakpoints, dtype=numpy.float64)
+        self._levels = numpy.asarray(levels, dtype=numpy.float64)
+        self._rates = numpy.asarray(rates, dtype=numpy.float64)
+        # exp(rate * n) for the first DECAY_CACHE_LENGTH samples, by segment
+        self._decays = {}
+
+    @classmethod
+    def fit(cls, enveloppe: WavSignal, segments: int = EXPONENTIAL_SEGMENTS):
+        """
+        Least squares fit of the log of the envelope after its peak.
+
+        The segments get longer as the note goes on (geometric spacing),
+        since the envelope changes fast just after the attack and barely at
+        the end. The ripples of the envelope are averaged out.
+        """
+        samples = numpy.asarray(enveloppe.get_signal(), dtype=numpy.float64)
+        peak = int(numpy.argmax(samples))
+        peak_level = samples[peak]
+        if peak_level <= 0:
+            return cls(0, [0], [0.0], [0.0])
+
+        quiet = numpy.flatnonzero(samples[:peak] < peak_level * ATTACK_THRESHOLD)
+        attack_start = quiet[-1] + 1 if len(quiet) > 0 else 0
+
+        decay_length = len(samples) - peak
+        if decay_length <= EXPONENTIAL_MIN_SEGMENT:
+            return cls(attack_start, [peak], [peak_level], [0.0])
+        breakpoints = peak + numpy.unique(
+            numpy.round(
+                numpy.append(
+                    0,
+                    numpy.geomspace(
+                        EXPONENTIAL_MIN_SEGMENT, decay_length - 1, segments
+                    ),
+                )
+            ).astype(numpy.int64)
+        )
+
+        # Each sample of the decay is a mix of the levels (in log) of the two
+        # breakpoints around it. The normal equations of that fit are
+        # tridiagonal, they're built without the (samples x breakpoints) matrix.
+        positions = numpy.arange(peak, len(samples))
+        log_samples = numpy.log(
+            numpy.maximum(samples[peak:], peak_level * EXPONENTIAL_FLOOR)
+        )
+        count = len(breakpoints)
+        segment = numpy.clip(
+            numpy.searchsorted(breakpoints, positions, side="right") - 1, 0, count - 2
+        )
+        left = breakpoints[segment]
+        right = breakpoints[segment + 1]
+        weight = (positions - left) / (right - left)
+
+        def accumulate(values, offset):
+            return numpy.bincount(segment + offset, values, minlength=count)
+
+        normal = numpy.diag(accumulate((1 - weight) ** 2, 0) + accumulate(weight**2, 1))
+        coupling = accumulate((1 - weight) * weight, 0)[:-1]
+        normal += numpy.diag(coupling, 1) + numpy.diag(coupling, -1)
+        projection = accumulate((1 - weight) * log_samples, 0) + accumulate(
+            weight * log_samples, 1
+        )
+        log_levels = numpy.linalg.solve(normal, projection)
+
+        rates = numpy.diff(log_levels) / numpy.diff(breakpoints)
+        rates = numpy.append(rates, min(rates[-1], 0.0))
+        return cls(attack_start, breakpoints, numpy.exp(log_levels), rates)
+
+    @classmethod
+    def from_arrays(cls, attack_start, breakpoints, levels, rates):
+        return cls(attack_start[0], breakpoints, levels, rates)
+
+    def to_arrays(self):
+        return [
+            numpy.array([self._attack_start]),
+            self._breakpoints,
+            self._levels,
+            self._rates,
+        ]
+
+    def get_attack_start(self):
+        return self._attack_start
+
+    def get_breakpoints(self):
+        return self._breakpoints
+
+    def get_levels(self):
+        return self._levels
+
+    def get_rates(self):
+        return self._rates
+
+    def get_length(self):
+        """
+        Amount of samples the envelope was fitted on
+        """
+        return int(self._breakpoints[-1]) + 1
+
+    def is_extendable(self):
+        """
+        Whether the envelope can be evaluated past get_length()
+        """
+        return True
+
+    def evaluate(self, start: int, stop: int):
+        """
+        Value of the envelope for every sample between start and stop.
+        Computed segment by segment, a block of samples rarely spans more
+        than one or two of them: each is a decay computed once, scaled to
+        where the block starts in the segment.
+        """
+        values = numpy.zeros(stop - start)
+        attack_end = int(self._breakpoints[0])
+
+        attack_first = max(start, self._attack_start)
+        attack_last = min(stop, attack_end)
+        if attack_first < attack_last:
+            values[attack_first - start : attack_last - start] = (
+                self._levels[0]
+                * (numpy.arange(attack_first, attack_last) - self._attack_start)
+                / max(attack_end - self._attack_start, 1)
+            )
+
+        if stop <= attack_end:
+            return values
+        first = numpy.searchsorted(self._breakpoints, max(start, attack_end), "right")
+        last = numpy.searchsorted(self._breakpoints, stop - 1, "right")
+        for segment in range(first - 1, last):
+            begin = max(start, int(self._breakpoints[segment]))
+            end = stop
+            if segment + 1 < len(self._breakpoints):
+                end = min(stop, int(self._breakpoints[segment + 1]))
+            offset = begin - self._breakpoints[segment]
+            values[begin - start : end - start] = (
+                self._levels[segment]
+                * numpy.exp(self._rates[segment] * offset)
+                * self._decay(segment, end - begin)
+            )
+        return values
+
+    def _decay(self, segment: int, length: int):
+        if length > DECAY_CACHE_LENGTH:
+            return numpy.exp(self._rates[segment] * numpy.arange(length))
+        decay = self._decays.get(segment)
+        if decay is None:
+            decay = numpy.exp(self._rates[segment] * numpy.arange(DECAY_CACHE_LENGTH))
+            self._decays[segment] = decay
+        return decay[:length]
@@ -9,6 +9,10 @@ def normalized_frequency():
     return numpy.pi / 1000
 
 
+# Normalized frequency where the gain of the filters is designed by default
+NORMALIZED_FREQUENCY = normalized_frequency()
+
+
 def normalized_to_hertz(normalized, sampling_rate):
     sampling_frequency = 1 / sampling_rate
     return (normalized * sampling_frequency) / (2 * numpy.pi)
@@ -18,86 +22,97 @@ def hertz_to_normalized(hertz, sampling_rate):
     return (2 * numpy.pi * hertz) / (1 / sampling_rate)
 
 
+def design_sliding_average_low_pass(
+    wanted_gains_dB,
+    normalized_frequencies=NORMALIZED_FREQUENCY,
+    lowest_coefficient: int = 1,
+    highest_coefficient: int = 1000,
+):
+    """
+    Finds the N order of a sliding average low pass filter whose gain at the
+    normalized frequency is the closest to the wanted gain.
+
+    Every N between lowest_coefficient and highest_coefficient is evaluated at
+    once with the closed form of the response, so many wanted gains and
+    frequencies can be designed in one call: they are broadcast together.
+
+    :param wanted_gains_dB: Gain(s) wanted, the sign is ignored (-3 and 3 are the same)
+    :param normalized_frequencies: Frequency(ies) where the gain is wanted
+    :return: The best orders (shape of the broadcast gains and frequencies),
+        the tested orders, and the gain curve in dB of every tested order
+        for each wanted gain / frequency (shape + (amount of orders,)).
+    """
+    wanted_gains_dB, normalized_frequencies = numpy.broadcast_arrays(
+        numpy.abs(numpy.asarray(wanted_gains_dB, dtype=numpy.float64)),
+        numpy.asarray(normalized_frequencies, dtype=numpy.float64),
+    )
+    all_N = numpy.arange(lowest_coefficient, highest_coefficient + 1)
+
+    gains = sliding_average_low_pass_response(all_N, normalized_frequencies[..., None])
+    gains_dB = 20 * numpy.log10(gains)
+
+    errors = numpy.abs(numpy.abs(gains_dB) - wanted_gains_dB[..., None])
+    best_orders = all_N[numpy.argmin(errors, axis=-1)]
+    return best_orders, all_N, gains_dB
+
+
 def best_sliding_average_low_pass_coefficient(
     wanted_gain_dB: int,
     max_tries: int = 1000,
     lowest_coefficient: int = 1,
     highest_coefficient: int = 1000,
-    normalized_frequency: float = normalized_frequency(),
+    normalized_frequency: float = NORMALIZED_FREQUENCY,
 ):
     """
     Automatically finds the best N order for a sliding average
-    low pass filter through trial and errors.
+    low pass filter.
 
     It's possible that the best N is a float, the closest is returned
     if that's the case.
 
+    Every N between lowest_coefficient and highest_coefficient is tested
+    at once by design_sliding_average_low_pass().
+
     :param wanted_gain: Description
     :type wanted_gain: int - 3
+    :param max_tries: Deprecated and ignored, it was the amount of steps
+        of the search by halves this replaced. Kept so calls passing it
+        still work.
     """
-    # To optimize the testing of N values, we test N in the middle of the allowed range.
-    # Then, if its above, we test a new middle, so on and so forth until the 2 N values
-    # are 1 appart, meaning it can't get closer than that.
-    current_try = 0
-    wanted_gain_dB = numpy.abs(wanted_gain_dB)
-
-    print(
-        f"Calculating best N order for a sliding average low-pass filter for a gain of {wanted_gain_dB}dB at normalized frequency: {normalized_frequency}"
+    best_orders, _, gains_dB = design_sliding_average_low_pass(
+        wanted_gain_dB, normalized_frequency, lowest_coefficient, highest_coefficient
     )
-
-    while current_try < max_tries:
-        current_try = current_try + 1
-
-        tested_filter_order = numpy.round(
-            (highest_coefficient + lowest_coefficient) / 2
-        )
-        gain_at_tested_order = sliding_average_low_pass_response(
-            tested_filter_order, normalized_frequency=normalized_frequency
-        )
-
-        gain_db = numpy.abs(20 * numpy.log10(gain_at_tested_order))
-
-        # Set new low and high thresholds depending on if we overshot or undershot the wanted gain.
-        if gain_db > wanted_gain_dB:
-            highest_coefficient = tested_filter_order
-        else:
-            lowest_coefficient = tested_filter_order
-
-        # testing is finished once the difference between the lowest and the highest coefficient is below 1.
-        if (highest_coefficient - lowest_coefficient) <= 1:
-            print(
-                f"\tG: N = {tested_filter_order}, gain = {gain_db}dB, attempt = {current_try}"
-            )
-            return tested_filter_order
-        print(
-            f"\tX: N = {tested_filter_order}, gain = {gain_db}dB, attempt = {current_try}"
-        )
-
+    best_order = float(best_orders)
+    gain_db = numpy.abs(gains_dB[int(best_order) - lowest_coefficient])
     print(
-        f"FATAL! Exceeded the maximum amount of tries: {max_tries} to obtain the N order of the filter!"
+        f"Best N order for a sliding average low-pass filter for a gain of {numpy.abs(wanted_gain_dB)}dB at normalized frequency {normalized_frequency}: N = {best_order}, gain = {gain_db}dB"
     )
-    return 0
+    return best_order
 
 
 def sliding_average_low_pass_response(
-    coefficient_count: int, normalized_frequency: float = normalized_frequency()
+    coefficient_count, normalized_frequency=NORMALIZED_FREQUENCY
 ):
     """
     Lyons low pass filter formula.
     Gets the gain at a given normalized frequency for an N order.
-    The response is calculated through the frequency response, which requires a sum.
-    It would be possible to not need the sum by using the geometric series to
-    simplify it, but python just allows us to do a sum. So... why not.
+    Both can be arrays, the gains are broadcast over them.
 
-    Formula is the following:
+    The sum of the frequency response is a geometric series,
+    so it's evaluated with its closed form (Dirichlet kernel):
     $$
-    H=\\frac{1}{N}\\sum^{N-1}_{n=0}e^{-j\\bar\\omega}
+    |H|=\\left|\\frac{1}{N}\\sum^{N-1}_{n=0}e^{-j\\bar\\omega n}\\right|
+    =\\left|\\frac{\\sin(N\\bar\\omega/2)}{N\\sin(\\bar\\omega/2)}\\right|
     $$
     """
-    all_N = numpy.arange(coefficient_count)
-    average = 1 / coefficient_count
-
-    gain = average * numpy.sum(numpy.exp(-1j * normalized_frequency * all_N))
+    coefficient_count = numpy.asarray(coefficient_count, dtype=numpy.float64)
+    half_frequency = numpy.asarray(normalized_frequency, dtype=numpy.float64) / 2
+
+    denominator = coefficient_count * numpy.sin(half_frequency)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        gain = numpy.sin(coefficient_count * half_frequency) / denominator
+    # At a null frequency, every sliding average has a unit gain.
+    gain = numpy.where(denominator == 0, 1.0, gain)
     return numpy.abs(gain)
 
 
@@ -1,7 +1,12 @@
+from code.artifactCache import array_hash, cached_arrays
+from code.decimation import plot_decimated
 from code.filters import (
+    NORMALIZED_FREQUENCY,
     best_sliding_average_low_pass_coefficient,
     sliding_average_low_pass_frequency_response,
 )
+from code.instrument import InstrumentModel
+from code.mixer import Mixer
 from code.music import (
     AMONG_US,
     BETHOVEN,
@@ -9,6 +14,7 @@ from code.music import (
     get_music,
     optimized_build_synthesized_note,
 )
+from code.pipeline import Pipeline
 from code.rawSignals import get_guitar
 from code.saveFigure import save_plot
 
@@ -16,6 +22,7 @@ from code.saveFigure import save_plot
 from code.signalAnalysis import (
     get_fondamental_harmonic_frequency,
     get_harmonics,
+    plot_harmonics,
     print_harmonics,
 )
 from code.signalFFT import SignalFFT
@@ -24,65 +31,274 @@ from code.signalModifications import (
     apply_gain,
     apply_sliding_average_low_pass_filter,
 )
+from code.signalSTFT import SignalSTFT
 from code.wavSignal import WavSignal
+from functools import partial
+from pathlib import Path
 
 import matplotlib.pyplot as plt
 import numpy
 
+# Musics rendered with the synthesized guitar, by output name
+MUSICS = {
+    "among_us": AMONG_US,
+    "bethoven": BETHOVEN,
+    "bethoven_trust": TRICKY,
+}
 
-def execute_guitar():
+# Model of the guitar, saved by the instrument stage. It's generated, so it goes
+# in build/ (ignored by git) rather than next to the recordings in audio/.
+INSTRUMENT_PATH = Path("build/guitar.instrument")
+
+
+def execute_guitar(*targets, workers: int | None = None):
+    """
+    Runs the guitar analysis, synthesis and music generation.
+    Give stage names (see build_guitar_pipeline()) to only compute those
+    and what they need, nothing given runs everything.
+
+    :param workers: Stages running at the same time, and notes of each music
+        rendered at the same time. None for one per core, 1 runs everything
+        one after the other.
+    """
     print("Executing code for guitar")
-    harmonics_index, harmonics_peaks = get_guitar_harmonics()
-    enveloppe = get_guitar_enveloppe()
-    plot_enveloppe(enveloppe)
+    return build_guitar_pipeline(workers).run(*targets, workers=workers)
+
+
+def build_guitar_pipeline(workers: int | None = 1):
+    """
+    Every step of the guitar analysis as a pipeline stage, with its inputs.
+    Plotting stages are serial since pyplot isn't thread-safe.
+
+    :param workers: Pitches of each music rendered at the same time
+        (see get_music()), the musics themselves being separate stages.
+    """
+    pipeline = Pipeline()
+    pipeline.add_stage("guitar", get_guitar)
+    pipeline.add_stage("abs_guitar", get_absolute_guitar, ["guitar"])
+    pipeline.add_stage("fft", get_guitar_fft, ["guitar"])
+    pipeline.add_stage("harmonics", get_guitar_harmonics, ["abs_guitar"])
+    pipeline.add_stage(
+        "plot_harmonics",
+        plot_guitar_harmonics,
+        ["abs_guitar", "harmonics"],
+        serial=True,
+    )
+    pipeline.add_stage("plot_stft", plot_guitar_stft, ["guitar"], serial=True)
+    pipeline.add_stage("filter_order", get_enveloppe_filter_order)
+    pipeline.add_stage(
+        "enveloppe", get_guitar_enveloppe, ["abs_guitar", "filter_order"]
+    )
+    pipeline.add_stage(
+        "plot_filter",
+        plot_filter_frequency_response,
+        ["filter_order", "guitar"],
+        serial=True,
+    )
+    pipeline.add_stage(
+        "plot_enveloppe", plot_enveloppe, ["enveloppe", "abs_guitar"], serial=True
+    )
+    pipeline.add_stage(
+        "synthesized", get_synthesized_guitar, ["harmonics", "enveloppe", "guitar"]
+    )
+    pipeline.add_stage("save_synthesized", save_synthesized_guitar, ["synthesized"])
+    pipeline.add_stage(
+        "plot_synthesized",
+        plot_synthesized_versus_original,
+        ["synthesized", "enveloppe", "guitar"],
+        serial=True,
+    )
+    pipeline.add_stage(
+        "plot_fft_synthesized",
+        plot_fft_synthesized_versus_original,
+        ["synthesized", "fft"],
+        serial=True,
+    )
+    pipeline.add_stage("fundamental", get_guitar_fundamental, ["guitar", "harmonics"])
+    pipeline.add_stage(
+        "instrument",
+        get_guitar_instrument,
+        ["harmonics", "enveloppe", "guitar", "fundamental"],
+    )
+    pipeline.add_stage("save_instrument", save_guitar_instrument, ["instrument"])
+    pipeline.add_stage(
+        "among_us_mixed",
+        partial(mix_guitar_music, "among_us_mixed", AMONG_US),
+        ["instrument"],
+    )
+    for name, music in MUSICS.items():
+        pipeline.add_stage(
+            name,
+            partial(render_guitar_music, name, music, workers=workers),
+            ["synthesized", "fundamental", "harmonics", "enveloppe", "guitar"],
+        )
+    return pipeline
+
 
-    synthesized = get_synthesized_guitar(harmonics_index, harmonics_peaks, enveloppe)
-    generate_guitar_music(synthesized, harmonics_index, harmonics_peaks, enveloppe)
+def get_absolute_guitar(guitar: WavSignal):
+    absolute = guitar.view()
+    apply_absolute(absolute)
+    return absolute
 
 
-def get_guitar_harmonics():
+def get_guitar_harmonics(absolute_guitar: WavSignal):
     print("Harmonic analysis of Guitar")
-    guitar = get_guitar()
-    apply_absolute(guitar)
-    harmonics_index, harmonics_peaks = get_harmonics(guitar, amount_to_get=31)
-    print_harmonics(guitar, harmonics_index, harmonics_peaks)
+
+    def compute():
+        indexes, peaks = get_harmonics(absolute_guitar, amount_to_get=31)
+        return {"indexes": indexes, "peaks": peaks}
+
+    harmonics = cached_arrays(
+        "harmonics",
+        [array_hash(absolute_guitar.get_signal())],
+        {"amount_to_get": 31},
+        compute,
+        code=[get_harmonics, SignalFFT],
+    )
+    harmonics_index, harmonics_peaks = harmonics["indexes"], harmonics["peaks"]
+    print_harmonics(absolute_guitar, harmonics_index, harmonics_peaks)
     return harmonics_index, harmonics_peaks
 
 
-def get_guitar_enveloppe():
+def plot_guitar_harmonics(absolute_guitar: WavSignal, harmonics):
+    harmonics_index, harmonics_peaks = harmonics
+    plot_harmonics(absolute_guitar, harmonics_index, harmonics_peaks)
+
+
+def plot_guitar_stft(guitar: WavSignal):
+    print("Plotting guitar's spectrogram")
+    SignalSTFT(guitar, frame_size=4096, hop=1024).full_plot(max_frequency=5000)
+
+
+def get_enveloppe_filter_order():
+    # Every argument of the search, so they're all part of the artifact key
+    parameters = {
+        "wanted_gain_dB": -3,
+        "max_tries": 10,
+        "lowest_coefficient": 1,
+        "highest_coefficient": 1000,
+        "normalized_frequency": NORMALIZED_FREQUENCY,
+    }
+
+    def compute():
+        return {"order": best_sliding_average_low_pass_coefficient(**parameters)}
+
+    order = cached_arrays(
+        "filter_order",
+        [],
+        parameters,
+        compute,
+        code=[best_sliding_average_low_pass_coefficient],
+    )["order"]
+    return float(order)
+
+
+def get_guitar_enveloppe(absolute_guitar: WavSignal, best_N):
     print("Getting enveloppe of Guitar")
-    guitar = get_guitar()
-    apply_absolute(guitar)
 
-    best_N = best_sliding_average_low_pass_coefficient(-3, 10, 1, 1000)
-    apply_sliding_average_low_pass_filter(guitar, best_N, "guitar_enveloppe")
-    plot_filter_frequency_response(best_N)
-    return guitar
+    def compute():
+        enveloppe = absolute_guitar.view()
+        apply_sliding_average_low_pass_filter(enveloppe, best_N, "guitar_enveloppe")
+        return {"enveloppe": enveloppe.get_signal()}
+
+    enveloppe = cached_arrays(
+        "enveloppe",
+        [array_hash(absolute_guitar.get_signal())],
+        {"order": best_N},
+        compute,
+        code=[apply_sliding_average_low_pass_filter],
+    )["enveloppe"]
+    return WavSignal.from_array(
+        "guitar_enveloppe", absolute_guitar.get_sampling_rate(), enveloppe
+    )
 
 
-def get_guitar_fft():
-    guitar = get_guitar()
-    fft = SignalFFT(guitar)
-    return fft
+def get_guitar_fft(guitar: WavSignal | None = None):
+    """
+    FFT of the guitar, kept on disk between runs.
+    """
+    if guitar is None:
+        guitar = get_guitar()
+    return SignalFFT(guitar, persistent=True)
 
 
-def get_synthesized_guitar(harmonics_index, harmonics_peaks, enveloppe):
+def get_synthesized_guitar(harmonics, enveloppe, guitar):
     print("Synthetizing guitar...")
-    synthesized = optimized_build_synthesized_note(
-        harmonics_index, harmonics_peaks, enveloppe, get_guitar()
+    harmonics_index, harmonics_peaks = harmonics
+    return optimized_build_synthesized_note(
+        harmonics_index, harmonics_peaks, enveloppe, guitar
     )
-    plot_synthesized_versus_original(synthesized, enveloppe)
-    plot_fft_synthesized_versus_original(synthesized)
+
+
+def save_synthesized_guitar(synthesized: WavSignal):
     print("saving synthesized signal audio")
     synthesized.save()
-    return synthesized
 
 
-def plot_filter_frequency_response(coefficient_count):
+def get_guitar_fundamental(guitar: WavSignal, harmonics):
+    harmonics_index, _ = harmonics
+    return get_fondamental_harmonic_frequency(guitar, harmonics_index)
+
+
+def get_guitar_instrument(harmonics, enveloppe, guitar, fundamental):
+    """
+    Model of the guitar (see InstrumentModel), built in memory only.
+    """
+    harmonics_index, harmonics_peaks = harmonics
+    return InstrumentModel.from_analysis(
+        "guitar", harmonics_index, harmonics_peaks, enveloppe, guitar, fundamental
+    )
+
+
+def save_guitar_instrument(instrument: InstrumentModel):
+    """
+    Saves the guitar's model in INSTRUMENT_PATH, to render musics from it
+    later with get_music_from_instrument() without analysing it again.
+    """
+    print(f"Saving guitar's instrument model in {INSTRUMENT_PATH}")
+    INSTRUMENT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    instrument.save(INSTRUMENT_PATH)
+
+
+def render_guitar_music(
+    name, music, synthesized, fundamental, harmonics, enveloppe, guitar, workers=1
+):
+    """
+    Renders a music with the synthesized guitar and saves it as name.wav
+    """
+    print(f"Generating {name}.wav")
+    harmonics_index, harmonics_peaks = harmonics
+    rendered = get_music(
+        synthesized,
+        fundamental,
+        harmonics_index,
+        harmonics_peaks,
+        enveloppe,
+        guitar,
+        music,
+        workers,
+    )
+    rendered.set_name(name)
+    rendered.save()
+    return rendered
+
+
+def mix_guitar_music(name, music, instrument: InstrumentModel):
+    """
+    Renders a music with the guitar's model, its notes ringing over each other
+    (see Mixer), and saves it as name.wav
+    """
+    print(f"Mixing {name}.wav")
+    mixed = Mixer(instrument).mix(music, name)
+    mixed.save()
+    return mixed
+
+
+def plot_filter_frequency_response(coefficient_count, guitar: WavSignal):
     frequencies, responses = sliding_average_low_pass_frequency_response(
-        coefficient_count, (get_guitar().get_sampling_rate())
+        coefficient_count, (guitar.get_sampling_rate())
     )
-    at3dB = ((numpy.pi / 1000) * get_guitar().get_sampling_rate()) / (2 * numpy.pi)
+    at3dB = ((numpy.pi / 1000) * guitar.get_sampling_rate()) / (2 * numpy.pi)
     plt.figure()
     # plt.title("Réponse en fréquence du filtre RIF")
     plt.plot(frequencies, responses, label="réponse")
@@ -98,71 +314,24 @@ def plot_filter_frequency_response(coefficient_count):
     plt.close()
 
 
-def generate_guitar_music(
-    synthesized,
-    harmonics_index,
-    harmonics_peaks,
-    enveloppe,
-):
-    guitar = get_guitar()
-    fundamental = get_fondamental_harmonic_frequency(guitar, harmonics_index)
-
-    print("Generating Among_us.wav")
-    music = get_music(
-        synthesized,
-        fundamental,
-        harmonics_index,
-        harmonics_peaks,
-        enveloppe,
-        get_guitar(),
-        AMONG_US,
-    )
-    music.set_name("among_us")
-    music.save()
-
-    print("Generating bethoven.wav")
-    bethoven = get_music(
-        synthesized,
-        fundamental,
-        harmonics_index,
-        harmonics_peaks,
-        enveloppe,
-        get_guitar(),
-        BETHOVEN,
-    )
-    bethoven.set_name("bethoven")
-    bethoven.save()
-
-    print("Generating tricky.wav")
-    tricky = get_music(
-        synthesized,
-        fundamental,
-        harmonics_index,
-        harmonics_peaks,
-        enveloppe,
-        get_guitar(),
-        TRICKY,
-    )
-    tricky.set_name("bethoven_trust")
-    tricky.save()
-
-
-def plot_enveloppe(enveloppe: WavSignal):
+def plot_enveloppe(enveloppe: WavSignal, absolute_guitar: WavSignal):
     print("Plotting guitar's enveloppe")
-    guitar = get_guitar()
-    apply_absolute(guitar)
 
     plt.figure()
-    guitar.partial_plot()
+    absolute_guitar.partial_plot()
     enveloppe.partial_plot()
-    apply_gain(enveloppe, 2)
     save_plot("guitar_enveloppe")
     plt.close()
 
 
-def plot_synthesized_versus_original(synthesized: WavSignal, enveloppe: WavSignal):
+def plot_synthesized_versus_original(
+    synthesized: WavSignal, enveloppe: WavSignal, original: WavSignal
+):
     print("Plotting difference between synthesized signal and original signal")
-    original = get_guitar()
+
+    # The enveloppe is drawn at twice its level
+    enveloppe = enveloppe.view()
+    apply_gain(enveloppe, 2)
 
     plt.figure()
     original.partial_plot()
@@ -172,11 +341,10 @@ def plot_synthesized_versus_original(synthesized: WavSignal, enveloppe: WavSigna
     plt.close()
 
 
-def plot_fft_synthesized_versus_original(synthesized: WavSignal):
+def plot_fft_synthesized_versus_original(synthesized: WavSignal, fft_guitar: SignalFFT):
     print("Fourier analysis of synthesized signal versus real one")
-    guitar = get_guitar()
+    guitar = fft_guitar.get_signal()
 
-    fft_guitar = SignalFFT(guitar)
     fft_synthesized = SignalFFT(synthesized)
 
     plt.figure()
@@ -184,9 +352,13 @@ def plot_fft_synthesized_versus_original(synthesized: WavSignal):
     plt.xlabel("Fréquence (Hz)")
     plt.ylabel("Amplitude (dB)")
     plt.xlim(0, 70000)
-    plt.plot(20 * numpy.log10(fft_guitar.get_amplitudes()), label=guitar.get_name())
-    plt.plot(
-        20 * numpy.log10(fft_synthesized.get_amplitudes()), label=synthesized.get_name()
+    plot_decimated(
+        None, 20 * numpy.log10(fft_guitar.get_amplitudes()), label=guitar.get_name()
+    )
+    plot_decimated(
+        None,
+        20 * numpy.log10(fft_synthesized.get_amplitudes()),
+        label=synthesized.get_name(),
     )
     plt.grid(True)
     plt.legend()
@@ -0,0 +1,231 @@
+import struct
+from code.envelope import BreakpointEnvelope, ExponentialEnvelope
+from code.signalFFT import SignalFFT
+from code.wavSignal import WavSignal
+
+import numpy
+
+# Binary format of the instrument files:
+# header, name (utf-8), then the float64 arrays one after the other:
+# frequencies, amplitudes, phases, then the arrays of the envelope.
+# Version 1 only had breakpoint envelopes, with two arrays of breakpoint_count
+# values. From version 2, the header tells the kind of envelope and each of
+# its arrays is preceded by its length (uint32).
+MAGIC = b"INST"
+FORMAT_VERSION = 2
+HEADER_V1 = struct.Struct("<4sHHIIddII")
+HEADER = struct.Struct("<4sHHIIddIHH")
+ARRAY_LENGTH = struct.Struct("<I")
+
+# Kind of envelope stored in the file
+ENVELOPE_KINDS = [BreakpointEnvelope, ExponentialEnvelope]
+
+
+class InstrumentModel:
+    """
+    Everything needed to synthesize notes of an instrument, extracted once
+    from a recording: its harmonics (frequency, amplitude and phase), its
+    envelope and the amplitude to scale the notes to.
+
+    It's saved in a small versioned binary file, so musics can be rendered
+    without the recording nor its FFT.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sampling_rate: int,
+        fundamental: float,
+        frequencies,
+        amplitudes,
+        phases,
+        envelope,
+        scale: float,
+        note_length: int,
+    ):
+        self._name = name
+        self._fs = sampling_rate
+        self._fundamental = fundamental
+        self._frequencies = numpy.asarray(frequencies, dtype=numpy.float64)
+        self._amplitudes = numpy.asarray(amplitudes, dtype=numpy.float64)
+        self._phases = numpy.asarray(phases, dtype=numpy.float64)
+        self._envelope = envelope
+        self._scale = scale
+        self._note_length = note_length
+
+    @classmethod
+    def from_analysis(
+        cls,
+        name: str,
+        harmonics_frequency_indexes,
+        harmonics_peaks,
+        enveloppe: WavSignal,
+        originalSignal: WavSignal,
+        fundamental: float,
+        parametric: bool = True,
+    ):
+        """
+        Builds the model from the analysis of the original signal
+        (see get_harmonics() and the guitar's enveloppe).
+
+        :param parametric: Fits the envelope with an ExponentialEnvelope,
+            so notes can be longer than the original signal.
+            Otherwise it's kept as a BreakpointEnvelope.
+        """
+        if parametric:
+            envelope = ExponentialEnvelope.fit(enveloppe)
+        else:
+            envelope = BreakpointEnvelope.from_signal(enveloppe)
+        fft = SignalFFT(originalSignal)
+        return cls(
+            name,
+            originalSignal.get_sampling_rate(),
+            fundamental,
+            fft.get_frequencies_at(harmonics_frequency_indexes),
+            harmonics_peaks,
+            fft.get_phases_at(harmonics_frequency_indexes),
+            envelope,
+            float(numpy.max(numpy.abs(originalSignal.get_signal()))),
+            originalSignal.get_sample_count(),
+        )
+
+    # Getters
+    def get_name(self):
+        return self._name
+
+    def get_sampling_rate(self):
+        return self._fs
+
+    def get_fundamental(self):
+        return self._fundamental
+
+    def get_frequencies(self):
+        return self._frequencies
+
+    def get_amplitudes(self):
+        return self._amplitudes
+
+    def get_phases(self):
+        return self._phases
+
+    def get_envelope(self):
+        return self._envelope
+
+    def get_scale(self):
+        """
+        Highest absolute sample of the original signal, notes are scaled to it.
+        """
+        return self._scale
+
+    def get_note_length(self):
+        """
+        Amount of samples of a note, as long as the original signal.
+        """
+        return self._note_length
+
+    def save(self, path: str):
+        name = self._name.encode("utf-8")
+        envelope_arrays = self._envelope.to_arrays()
+        with open(path, "wb") as file:
+            file.write(
+                HEADER.pack(
+                    MAGIC,
+                    FORMAT_VERSION,
+                    len(name),
+                    self._fs,
+                    self._note_length,
+                    self._fundamental,
+                    self._scale,
+                    len(self._frequencies),
+                    ENVELOPE_KINDS.index(type(self._envelope)),
+                    len(envelope_arrays),
+                )
+            )
+            file.write(name)
+            file.writelines(
+                numpy.ascontiguousarray(array, dtype="<f8").tobytes()
+                for array in [self._frequencies, self._amplitudes, self._phases]
+            )
+            for array in envelope_arrays:
+                file.write(ARRAY_LENGTH.pack(len(array)))
+                file.write(numpy.ascontiguousarray(array, dtype="<f8").tobytes())
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Loads an instrument saved by save(), in any version of the format.
+        """
+        with open(path, "rb") as file:
+            data = file.read()
+
+        magic, version = struct.unpack_from("<4sH", data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} isn't an instrument file")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"{path} has a newer format: {version}")
+
+        if version == 1:
+            (
+                _,
+                _,
+                name_length,
+                sampling_rate,
+                note_length,
+                fundamental,
+                scale,
+                harmonic_count,
+                breakpoint_count,
+            ) = HEADER_V1.unpack_from(data)
+            offset = HEADER_V1.size
+        else:
+            (
+                _,
+                _,
+                name_length,
+                sampling_rate,
+                note_length,
+                fundamental,
+                scale,
+                harmonic_count,
+                envelope_kind,
+                envelope_array_count,
+            ) = HEADER.unpack_from(data)
+            offset = HEADER.size
+
+        name = data[offset : offset + name_length].decode("utf-8")
+        offset += name_length
+
+        def read(count):
+            nonlocal offset
+            array = numpy.frombuffer(data, dtype="<f8", count=count, offset=offset)
+            offset += 8 * count
+            return array
+
+        def read_with_length():
+            nonlocal offset
+            (count,) = ARRAY_LENGTH.unpack_from(data, offset)
+            offset += ARRAY_LENGTH.size
+            return read(count)
+
+        frequencies = read(harmonic_count)
+        amplitudes = read(harmonic_count)
+        phases = read(harmonic_count)
+        if version == 1:
+            envelope = BreakpointEnvelope(
+                read(breakpoint_count), read(breakpoint_count)
+            )
+        else:
+            arrays = [read_with_length() for _ in range(envelope_array_count)]
+            envelope = ENVELOPE_KINDS[envelope_kind].from_arrays(*arrays)
+
+        return cls(
+            name,
+            sampling_rate,
+            fundamental,
+            frequencies,
+            amplitudes,
+            phases,
+            envelope,
+            scale,
+            note_length,
+        )
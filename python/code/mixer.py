@@ -0,0 +1,246 @@
+from code.dtypePolicy import get_processing_dtype
+from code.instrument import InstrumentModel
+from code.music import NOTE_OFFSET, NOTES
+from code.synthesizer import harmonics_peak, synthesize_harmonics
+from code.wavetable import Wavetable
+from code.wavSignal import WavSignal
+
+import numpy
+
+# Notes sounding at the same time, at most. Past it, the oldest one is stolen.
+MAX_VOICES = 8
+
+# Seconds a note keeps ringing (fading out) after its duration.
+RELEASE = 0.25
+
+# Seconds a stolen note takes to fade out, short but without a click.
+STEAL_FADE = 0.005
+
+
+class Voice:
+    """
+    One note on the timeline of a Mixer, in samples.
+    It plays from start, fades out from off and is silent from end.
+    The fade is linear, except for a note stolen while fading out: it then
+    bends at knee, where the faster fade of the steal starts.
+    """
+
+    def __init__(self, ratio: float, start: int, off: int, end: int, gain: float):
+        self.ratio = ratio
+        self.start = start
+        self.off = off
+        self.end = end
+        self.gain = gain
+        self.knee = end
+        self.knee_gain = 0.0
+
+    def fade(self, first: int, last: int):
+        """
+        Gains of the fade out from first to last (excluded), 1 before off.
+        """
+        return numpy.interp(
+            numpy.arange(first, last),
+            [self.off, self.knee, self.end],
+            [1.0, self.knee_gain, 0.0],
+        )
+
+    def steal(self, at: int, fade: int):
+        """
+        Fades the note out from at, if it wasn't already fading out sooner.
+        A note already fading out continues from the gain it has at at,
+        so its gain never jumps.
+        """
+        if at + fade >= self.end:
+            return
+        if at > self.off:
+            self.knee_gain = float(self.fade(at, at + 1)[0])
+            self.knee = at
+        else:
+            self.off = at
+            self.knee = at + fade
+        self.end = at + fade
+
+
+class Mixer:
+    """
+    Polyphonic rendering of a music with an instrument model.
+
+    Each note of the music is a dictionary with "note" and "duration" (in
+    seconds), like in code.music, and optionally "start" (in seconds) and
+    "gain". Without start, a note starts when the previous one ends, so the
+    monophonic musics play as before, but every note keeps ringing for the
+    release after its duration, over the next ones. Notes with the same start
+    make a chord.
+
+    At most max_voices notes sound at the same time: a note starting when
+    all of them are used steals the oldest one, which quickly fades out.
+    So the cost of a music is bounded by max_voices times its length,
+    however dense it is.
+
+    Notes are summed in place in one buffer allocated for the whole music,
+    in the processing type (see code.dtypePolicy).
+
+    :param method: "additive" or "wavetable", see get_music()
+    """
+
+    def __init__(
+        self,
+        instrument: InstrumentModel,
+        max_voices: int = MAX_VOICES,
+        release: float = RELEASE,
+        method: str = "wavetable",
+    ):
+        if method not in ("additive", "wavetable"):
+            raise ValueError(f"Unknown method: {method}")
+        self._instrument = instrument
+        self._max_voices = max_voices
+        self._release = release
+        self._wavetable = None
+        if method == "wavetable":
+            self._wavetable = Wavetable(
+                instrument.get_frequencies(),
+                instrument.get_amplitudes(),
+                instrument.get_phases(),
+                instrument.get_fundamental(),
+            )
+        # Highest sample of the whole note at each pitch, to normalize it
+        self._peaks = {}
+
+    # Getters
+    def get_instrument(self):
+        return self._instrument
+
+    def get_max_voices(self):
+        return self._max_voices
+
+    def get_release(self):
+        return self._release
+
+    def schedule(self, music):
+        """
+        Voices of the notes of the music, with the stolen ones cut short.
+        """
+        fs = self._instrument.get_sampling_rate()
+        release = int(self._release * fs)
+        fade = max(int(STEAL_FADE * fs), 1)
+
+        voices = []
+        time = 0.0
+        for note in music:
+            start_time = note.get("start", time)
+            time = start_time + note["duration"]
+            frequency = NOTES[note["note"]]
+            if frequency == 0:
+                continue
+
+            start = round(start_time * fs)
+            off = round(time * fs)
+            voice = Voice(
+                frequency / self._instrument.get_fundamental(),
+                start,
+                off,
+                off + release,
+                note.get("gain", 1.0),
+            )
+            voices.append(voice)
+
+        # Sorted by start, a chord written in any order is allocated the same
+        playing = []
+        for voice in sorted(voices, key=lambda voice: voice.start):
+            playing = [other for other in playing if other.end > voice.start]
+            if len(playing) >= self._max_voices:
+                playing.pop(0).steal(voice.start, fade)
+            playing.append(voice)
+        return voices
+
+    def mix(self, music, name: str = "mix"):
+        """
+        Renders the music, its samples are scaled down only if the notes
+        summed together would clip.
+        """
+        voices = self.schedule(music)
+        fs = self._instrument.get_sampling_rate()
+        length = max((voice.end for voice in voices), default=0)
+        output = numpy.zeros(length, dtype=get_processing_dtype())
+
+        for voice in voices:
+            output[voice.start : voice.end] += self.render_voice(voice)
+
+        peak = numpy.max(numpy.abs(output), initial=0)
+        limit = numpy.iinfo(numpy.int16).max
+        if peak > limit:
+            output *= limit / peak
+        return WavSignal.from_array(name, fs, output)
+
+    def prepare(self, voices):
+        """
+        Measures the peak of every pitch of the voices beforehand,
+        so rendering them afterwards only synthesizes their samples.
+        """
+        for voice in voices:
+            self._peak(voice.ratio)
+
+    def render_voice(
+        self, voice: Voice, first: int | None = None, last: int | None = None
+    ):
+        """
+        Samples of a voice between first and last (on the timeline, its start
+        and its end by default), scaled like the notes of get_music() and
+        faded out from its off (see Voice.fade()).
+        """
+        first = voice.start if first is None else first
+        last = voice.end if last is None else last
+        samples = self._synthesize(
+            voice.ratio,
+            NOTE_OFFSET + first - voice.start,
+            NOTE_OFFSET + last - voice.start,
+        )
+        samples *= voice.gain * self._instrument.get_scale() / self._peak(voice.ratio)
+
+        if last > voice.off:
+            fade_first = max(first, voice.off)
+            samples[fade_first - first :] *= voice.fade(fade_first, last)
+        return samples
+
+    def _synthesize(self, ratio: float, start: int, stop: int):
+        instrument = self._instrument
+        if self._wavetable is not None:
+            return self._wavetable.synthesize(
+                instrument.get_envelope(),
+                instrument.get_sampling_rate(),
+                ratio,
+                start,
+                stop,
+            )
+        return synthesize_harmonics(
+            instrument.get_frequencies(),
+            instrument.get_amplitudes(),
+            instrument.get_phases(),
+            instrument.get_envelope(),
+            instrument.get_sampling_rate(),
+            ratio,
+            start,
+            stop,
+        )
+
+    def _peak(self, ratio: float):
+        if ratio not in self._peaks:
+            instrument = self._instrument
+            arguments = (
+                instrument.get_envelope(),
+                instrument.get_sampling_rate(),
+                ratio,
+                0,
+                instrument.get_note_length(),
+            )
+            if self._wavetable is not None:
+                peak = self._wavetable.peak(*arguments)
+            else:
+                peak = harmonics_peak(
+                    instrument.get_frequencies(),
+                    instrument.get_amplitudes(),
+                    instrument.get_phases(),
+                    *arguments,
+                )
+            self._peaks[ratio] = peak if peak > 0 else 1.0
+        return self._peaks[ratio]
@@ -1,6 +1,12 @@
 import copy
+from code.dtypePolicy import get_processing_dtype, to_output
+from code.instrument import InstrumentModel
+from code.pitchShift import shift_pitch_resample
 from code.signalFFT import SignalFFT
+from code.synthesizer import harmonics_peak, synthesize_harmonics
+from code.wavetable import Wavetable
 from code.wavSignal import WavSignal
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy
 
@@ -179,6 +185,21 @@ TRICKY = [
 ]
 
 
+# Samples skipped at the start of the synthesized note (the attack) for each note of a music.
+NOTE_OFFSET = 6000
+
+
+def _get_harmonics_parameters(harmonics_frequency_indexes, harmonics_peaks, signal):
+    """
+    Frequencies, amplitudes and phases of the harmonics, taken from the FFT of the signal.
+    """
+    fft = SignalFFT(signal)
+    frequencies = fft.get_frequencies_at(harmonics_frequency_indexes)
+    phases = fft.get_phases_at(harmonics_frequency_indexes)
+    amplitudes = numpy.asarray(harmonics_peaks)
+    return frequencies, amplitudes, phases
+
+
 def optimized_build_synthesized_note(
     harmonics_frequency_indexes,
     harmonics_peaks,
@@ -186,8 +207,6 @@ def optimized_build_synthesized_note(
     originalSignal: WavSignal,
     k: float = 1,
 ):
-    fft = SignalFFT(originalSignal)
-
     sample_count = originalSignal.get_sample_count()
     sampling_rate = originalSignal.get_sampling_rate()
 
@@ -195,29 +214,18 @@ def optimized_build_synthesized_note(
     new_signal = copy.deepcopy(originalSignal)
     new_signal.set_name(f"synthesized {originalSignal.get_name()}")
 
-    # Time axis (seconds)
-    t = numpy.arange(sample_count) / sampling_rate
-
     # Fetch FFT data ONCE
-    frequencies = fft.get_frequencies_axis()[harmonics_frequency_indexes]
-    phases = fft.get_phases()[harmonics_frequency_indexes]
-    amplitudes = numpy.asarray(harmonics_peaks)
+    frequencies, amplitudes, phases = _get_harmonics_parameters(
+        harmonics_frequency_indexes, harmonics_peaks, originalSignal
+    )
 
     # Envelope
     envelope = enveloppe.get_signal().astype(numpy.float64)
 
-    # Build harmonics matrix: shape (num_harmonics, num_samples)
-    # Each row is one harmonic over time
-    harmonics = amplitudes[:, None] * numpy.sin(
-        2 * numpy.pi * frequencies[:, None] * t * k + phases[:, None]
+    synthesized = synthesize_harmonics(
+        frequencies, amplitudes, phases, envelope, sampling_rate, k, 0, sample_count
     )
 
-    # Sum all harmonics
-    synthesized = harmonics.sum(axis=0)
-
-    # Apply envelope
-    synthesized *= envelope[: len(synthesized)]
-
     # Normalize
     max_val = numpy.max(numpy.abs(synthesized))
     if max_val > 0:
@@ -227,12 +235,81 @@ def optimized_build_synthesized_note(
     max_old = numpy.max(numpy.abs(originalSignal.get_signal()))
     synthesized *= max_old
 
-    # Convert to int16
-    new_signal.set_signal(synthesized.astype(numpy.int16))
+    # Back to the processing type, it's converted to 16 bits when saved
+    new_signal.set_signal(synthesized.astype(get_processing_dtype()))
 
     return new_signal
 
 
+def render_note_window(
+    frequencies,
+    amplitudes,
+    phases,
+    envelope,
+    sampling_rate: int,
+    sample_count: int,
+    max_old,
+    k: float,
+    start: int,
+    stop: int,
+):
+    """
+    Same samples as optimized_build_synthesized_note(...)[start:stop],
+    without synthesizing the whole note.
+
+    The peak of the whole note is still needed to normalize it, it's
+    measured block by block so the memory stays bounded by the window.
+    """
+    max_val = harmonics_peak(
+        frequencies, amplitudes, phases, envelope, sampling_rate, k, 0, sample_count
+    )
+
+    synthesized = synthesize_harmonics(
+        frequencies, amplitudes, phases, envelope, sampling_rate, k, start, stop
+    )
+    return _scale_note(synthesized, max_val, max_old)
+
+
+def render_wavetable_note_window(
+    wavetable: Wavetable,
+    envelope,
+    sampling_rate: int,
+    sample_count: int,
+    max_old,
+    k: float,
+    start: int,
+    stop: int,
+):
+    """
+    Same as render_note_window(), with the note read from a wavetable.
+    """
+    max_val = wavetable.peak(envelope, sampling_rate, k, 0, sample_count)
+    synthesized = wavetable.synthesize(envelope, sampling_rate, k, start, stop)
+    return _scale_note(synthesized, max_val, max_old)
+
+
+def render_resampled_note_window(
+    base_note, sample_count: int, max_old, k: float, start: int, stop: int
+):
+    """
+    Same as render_note_window(), with the note resampled from base_note,
+    the note synthesized at the original pitch (see shift_pitch_resample()).
+    """
+    shifted = shift_pitch_resample(base_note, k)
+    max_val = numpy.max(numpy.abs(shifted[:sample_count]))
+    synthesized = numpy.zeros(stop - start)
+    available = shifted[start:stop]
+    synthesized[: len(available)] = available
+    return _scale_note(synthesized, max_val, max_old)
+
+
+def _scale_note(synthesized, max_val, max_old):
+    if max_val > 0:
+        synthesized /= max_val
+    synthesized *= max_old
+    return synthesized.astype(get_processing_dtype())
+
+
 def build_synthesized_note(
     harmonics_frequency_indexes,
     harmonics_peaks,
@@ -254,7 +331,7 @@ def build_synthesized_note(
     new_signal.set_name(f"synthesized {originalSignal.get_name()}")
 
     # IMPORTANT: convert signal buffer to float
-    new_signal.set_signal(new_signal.get_signal().astype(numpy.float64))
+    new_signal.set_signal(new_signal.get_signal().astype(get_processing_dtype()))
 
     max_val = numpy.max(numpy.abs(new_signal.get_signal()))
 
@@ -286,7 +363,7 @@ def build_synthesized_note(
     max_old_signal = numpy.max(numpy.abs(originalSignal.get_signal()))
     difference = max_old_signal / max_new_signal
 
-    new_signal.set_signal(numpy.int16(new_signal.get_signal() * difference))
+    new_signal.set_signal(to_output(new_signal.get_signal() * difference))
 
     return new_signal
 
@@ -299,33 +376,253 @@ def get_music(
     enveloppe: WavSignal,
     originalSignal: WavSignal,
     music=AMONG_US,
+    workers: int = 1,
+    method: str = "additive",
+):
+    """
+    Renders a music (list of notes and durations) from the harmonics of the original signal.
+
+    Notes sharing the same pitch are synthesized once, and only for the
+    samples the longest of them actually plays.
+
+    :param workers: Amount of pitches rendered at the same time, None for one
+        per core. The numpy kernels release the GIL so threads are enough.
+        The output is the same whatever the amount of workers.
+    :param method: "additive" sums every harmonic for each sample,
+        "wavetable" reads one cycle computed once (see Wavetable), about
+        11 times faster per note and 7 times for a whole music, which
+        also spends time mixing the notes. "resample" synthesizes
+        the note once and resamples it for each pitch: its envelope is
+        then shorter for higher notes (see shift_pitch_resample()).
+    """
+    frequencies, amplitudes, phases = _get_harmonics_parameters(
+        harmonics_frequency_indexes, harmonics_peaks, originalSignal
+    )
+    envelope = enveloppe.get_signal().astype(numpy.float64)
+    max_old = numpy.max(numpy.abs(originalSignal.get_signal()))
+
+    full_signal = _render_music(
+        frequencies,
+        amplitudes,
+        phases,
+        envelope,
+        originalSignal.get_sampling_rate(),
+        originalSignal.get_sample_count(),
+        max_old,
+        original_frequency,
+        music,
+        workers,
+        method,
+    )
+
+    music_wav = copy.deepcopy(synthesized_note)
+    music_wav.set_signal(full_signal)
+    return music_wav
+
+
+def get_music_from_instrument(
+    instrument: InstrumentModel,
+    music=AMONG_US,
+    workers: int = 1,
+    method: str = "additive",
+):
+    """
+    Renders a music with an instrument model, same as get_music()
+    but without the original signal nor its FFT.
+    With a parametric envelope, notes aren't limited to the length
+    of the original signal.
+    """
+    full_signal = _render_music(
+        instrument.get_frequencies(),
+        instrument.get_amplitudes(),
+        instrument.get_phases(),
+        instrument.get_envelope(),
+        instrument.get_sampling_rate(),
+        instrument.get_note_length(),
+        instrument.get_scale(),
+        instrument.get_fundamental(),
+        music,
+        workers,
+        method,
+        instrument.get_envelope().is_extendable(),
+    )
+    return WavSignal.from_array(
+        f"music of {instrument.get_name()}", instrument.get_sampling_rate(), full_signal
+    )
+
+
+def stream_music_from_instrument(
+    instrument: InstrumentModel,
+    music=AMONG_US,
+    workers: int = 1,
+    method: str = "additive",
+):
+    """
+    Same samples as get_music_from_instrument(), yielded note by note for
+    write_wav(), so the whole music is never in memory: only the longest
+    note of each pitch is.
+    """
+    needed, rendered = _render_notes(
+        instrument.get_frequencies(),
+        instrument.get_amplitudes(),
+        instrument.get_phases(),
+        instrument.get_envelope(),
+        instrument.get_sampling_rate(),
+        instrument.get_note_length(),
+        instrument.get_scale(),
+        instrument.get_fundamental(),
+        music,
+        workers,
+        method,
+        instrument.get_envelope().is_extendable(),
+    )
+    for ratio, length in needed:
+        yield rendered[ratio][:length]
+
+
+def _render_music(
+    frequencies,
+    amplitudes,
+    phases,
+    envelope,
+    sampling_rate: int,
+    sample_count: int,
+    max_old,
+    original_frequency,
+    music,
+    workers: int,
+    method: str = "additive",
+    extendable: bool = False,
 ):
-    generated = []
+    """
+    Samples of a music, every note being rendered by render_note_window().
 
+    :param extendable: The envelope can be evaluated past sample_count,
+        so notes aren't cut there.
+    """
+    needed, rendered = _render_notes(
+        frequencies,
+        amplitudes,
+        phases,
+        envelope,
+        sampling_rate,
+        sample_count,
+        max_old,
+        original_frequency,
+        music,
+        workers,
+        method,
+        extendable,
+    )
+    full_signal = numpy.empty(
+        sum(length for _, length in needed), dtype=get_processing_dtype()
+    )
+    position = 0
+    for ratio, length in needed:
+        full_signal[position : position + length] = rendered[ratio][:length]
+        position += length
+    return full_signal
+
+
+def _render_notes(
+    frequencies,
+    amplitudes,
+    phases,
+    envelope,
+    sampling_rate: int,
+    sample_count: int,
+    max_old,
+    original_frequency,
+    music,
+    workers: int,
+    method: str = "additive",
+    extendable: bool = False,
+):
+    """
+    (ratio, length) of each note of the music, and the samples of the longest
+    note of each ratio, see _render_music().
+    """
+    # Samples needed by each note, and the most needed by each pitch
+    needed = []
+    longest = {}
     for n in music:
         name = n["note"]
         duration = n["duration"]
 
         freq = NOTES[name]
-        # note = shift_pitch_resample(
-        #     original_frequency, freq, synthesized_note, duration
-        # )
         ratio = freq / original_frequency
-        note = optimized_build_synthesized_note(
-            harmonics_frequency_indexes,
-            harmonics_peaks,
-            enveloppe,
-            originalSignal,
+        stop = int(duration * sampling_rate) + NOTE_OFFSET
+        if not extendable:
+            stop = min(stop, sample_count)
+        length = max(stop - NOTE_OFFSET, 0)
+        needed.append((ratio, length))
+        longest[ratio] = max(longest.get(ratio, 0), length)
+
+    def render_additive(ratio):
+        return render_note_window(
+            frequencies,
+            amplitudes,
+            phases,
+            envelope,
+            sampling_rate,
+            sample_count,
+            max_old,
             ratio,
+            NOTE_OFFSET,
+            NOTE_OFFSET + longest[ratio],
         )
-        signal = note.get_signal()[
-            6000 : int(duration * note.get_sampling_rate()) + 6000
-        ]
-        generated.append(signal)
 
-    # Concatenate everything ONCE (much cleaner)
-    full_signal = numpy.concatenate(generated)
+    if method == "additive":
+        render = render_additive
+
+    elif method == "wavetable":
+        wavetable = Wavetable(frequencies, amplitudes, phases, original_frequency)
+        # Built before the threads start, they would all build the same tables
+        for ratio in longest:
+            wavetable.get_table(ratio, sampling_rate)
+
+        def render(ratio):
+            return render_wavetable_note_window(
+                wavetable,
+                envelope,
+                sampling_rate,
+                sample_count,
+                max_old,
+                ratio,
+                NOTE_OFFSET,
+                NOTE_OFFSET + longest[ratio],
+            )
 
-    music_wav = copy.deepcopy(synthesized_note)
-    music_wav.set_signal(full_signal)
-    return music_wav
+    elif method == "resample":
+        # Higher notes read further in the note at the original pitch
+        base_length = sample_count
+        if extendable:
+            base_length = max(
+                [sample_count]
+                + [int((NOTE_OFFSET + longest[ratio]) * ratio) + 1 for ratio in longest]
+            )
+        base_note = synthesize_harmonics(
+            frequencies, amplitudes, phases, envelope, sampling_rate, 1, 0, base_length
+        )
+
+        def render(ratio):
+            if ratio <= 0:
+                return render_additive(ratio)
+            return render_resampled_note_window(
+                base_note,
+                sample_count,
+                max_old,
+                ratio,
+                NOTE_OFFSET,
+                NOTE_OFFSET + longest[ratio],
+            )
+
+    else:
+        raise ValueError(f"Unknown method: {method}")
+
+    if workers == 1:
+        rendered = {ratio: render(ratio) for ratio in longest}
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            rendered = dict(zip(longest, executor.map(render, longest)))
+    return needed, rendered
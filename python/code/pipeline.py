@@ -0,0 +1,166 @@
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Held by every serial stage, matplotlib's pyplot isn't thread-safe.
+_serial_lock = threading.Lock()
+
+# Held while a whole line is written, see LineWriter.
+_print_lock = threading.Lock()
+
+
+class LineWriter:
+    """
+    Stands for sys.stdout while stages run at the same time: what each thread
+    prints is written a whole line at a time, so the lines of stages running
+    together don't get mixed up.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._pending = threading.local()
+
+    def write(self, text: str):
+        pending = getattr(self._pending, "text", "") + text
+        lines, newline, rest = pending.rpartition("\n")
+        if newline:
+            with _print_lock:
+                self._stream.write(lines + newline)
+        self._pending.text = rest
+        return len(text)
+
+    def flush(self):
+        with _print_lock:
+            self._stream.flush()
+
+    def end_line(self):
+        """
+        Writes what this thread printed without ending its line,
+        as a line of its own.
+        """
+        pending = getattr(self._pending, "text", "")
+        self._pending.text = ""
+        if pending:
+            self.write(pending + "\n")
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class Pipeline:
+    """
+    Dependency graph of the stages of an analysis.
+    Each stage is a function receiving the results of the stages it depends on,
+    in the order they were declared.
+
+    run() only computes the stages the asked targets need, each one once:
+    results are kept, so asking for them again (even in a later run) is free.
+    Stages that don't depend on each other run at the same time.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, function, dependencies=(), serial: bool = False):
+        """
+        :param serial: The stage never runs at the same time as another
+            serial stage. Use it for every stage drawing with pyplot.
+        """
+        for dependency in dependencies:
+            if dependency not in self._stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+        self._stages[name] = (function, tuple(dependencies), serial)
+
+    def get_stage_names(self):
+        return list(self._stages)
+
+    def get_result(self, name: str):
+        return self._results[name]
+
+    def run(self, *targets, workers: int | None = None):
+        """
+        Computes the targets (every stage if none are given) and what they depend on.
+
+        :param workers: Stages running at the same time, None for one per core.
+            workers=1 runs the stages one after the other, in declaration order.
+        :return: Dictionary of the result of each target
+        """
+        if len(targets) == 0:
+            targets = self.get_stage_names()
+        needed = self._needed(targets)
+
+        with self._lock:
+            remaining = [name for name in needed if name not in self._results]
+
+        if workers == 1:
+            for name in remaining:
+                self._results[name] = self._execute(name)
+        else:
+            self._run_concurrently(remaining, workers)
+
+        return {name: self._results[name] for name in targets}
+
+    def _needed(self, targets):
+        """
+        Stages needed by the targets, every stage after its dependencies.
+        """
+        ordered = []
+        visiting = set()
+
+        def visit(name):
+            if name in ordered:
+                return
+            if name not in self._stages:
+                raise ValueError(f"Unknown stage: {name}")
+            if name in visiting:
+                raise ValueError(f"Stage {name} depends on itself")
+            visiting.add(name)
+            for dependency in self._stages[name][1]:
+                visit(dependency)
+            visiting.remove(name)
+            ordered.append(name)
+
+        for target in targets:
+            visit(target)
+        return ordered
+
+    def _run_concurrently(self, remaining, workers):
+        waiting = list(remaining)
+        running = {}
+
+        stdout = sys.stdout
+        sys.stdout = LineWriter(stdout)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                while waiting or running:
+                    for name in list(waiting):
+                        dependencies = self._stages[name][1]
+                        if all(
+                            dependency in self._results for dependency in dependencies
+                        ):
+                            waiting.remove(name)
+                            future = executor.submit(self._execute_ending_lines, name)
+                            running[future] = name
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        self._results[name] = future.result()
+        finally:
+            sys.stdout = stdout
+
+    def _execute_ending_lines(self, name):
+        try:
+            return self._execute(name)
+        finally:
+            sys.stdout.end_line()
+
+    def _execute(self, name):
+        function, dependencies, serial = self._stages[name]
+        arguments = [self._results[dependency] for dependency in dependencies]
+        if serial:
+            with _serial_lock:
+                return function(*arguments)
+        return function(*arguments)
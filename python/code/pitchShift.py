@@ -0,0 +1,54 @@
+from fractions import Fraction
+from functools import lru_cache
+
+from scipy import signal
+
+# Largest denominator of the resampling ratio. For the notes of the guitar the
+# pitch is then within 0.1 cent of the asked one (16 gives up to 15 cents),
+# and a longer filter barely slows the resampling down.
+RESAMPLE_MAX_DENOMINATOR = 128
+
+# Half length of the filters in periods of the slowest rate, like resample_poly
+RESAMPLE_HALF_LENGTH = 10
+
+
+def resampling_ratio(k: float, max_denominator: int = RESAMPLE_MAX_DENOMINATOR):
+    """
+    up and down such that reading up/down samples per sample raises the
+    pitch by about k. The pitch can't be raised by much more than
+    max_denominator, up would be 0 samples.
+    """
+    ratio = Fraction(1 / k).limit_denominator(max_denominator)
+    if ratio.numerator < 1:
+        raise ValueError(
+            f"Can't raise the pitch by {k} with at most {max_denominator} "
+            "samples read per sample"
+        )
+    return ratio.numerator, ratio.denominator
+
+
+@lru_cache(maxsize=64)
+def resampling_filter(up: int, down: int):
+    """
+    Low-pass filter of resample_poly() for these rates, designed once.
+    It's the one resample_poly() designs itself when not given any,
+    resample_poly() still applies the gain of up to it.
+    """
+    highest = max(up, down)
+    half_length = RESAMPLE_HALF_LENGTH * highest
+    coefficients = signal.firwin(
+        2 * half_length + 1, 1 / highest, window=("kaiser", 5.0)
+    )
+    coefficients.flags.writeable = False
+    return coefficients
+
+
+def shift_pitch_resample(
+    samples, k: float, max_denominator: int = RESAMPLE_MAX_DENOMINATOR
+):
+    """
+    Raises the pitch of samples by k by resampling them (polyphase).
+    The note is also k times shorter, its envelope included.
+    """
+    up, down = resampling_ratio(k, max_denominator)
+    return signal.resample_poly(samples, up, down, window=resampling_filter(up, down))
@@ -1,15 +1,15 @@
 from code.saveFigure import save_plot
-from code.wavSignal import WavSignal
+from code.signalCache import load_signal
 
 import matplotlib.pyplot as plt
 
 
 def get_guitar():
-    return WavSignal("audio/note_guitare_lad.wav")
+    return load_signal("audio/note_guitare_lad.wav")
 
 
 def get_bassoon():
-    return WavSignal("audio/note_basson_plus_sinus_1000_hz.wav")
+    return load_signal("audio/note_basson_plus_sinus_1000_hz.wav")
 
 
 def plot_raw_signals():
@@ -0,0 +1,281 @@
+import csv
+import time
+from code.dtypePolicy import DITHER_SEED, get_processing_dtype, to_output
+from code.instrument import InstrumentModel
+from code.mixer import MAX_VOICES, Mixer
+from code.saveFigure import save_plot
+from code.wavWriter import WavWriter
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+import numpy
+
+# Samples per block, like the buffer of a sound card. The deadline of a block
+# is the time it takes to play one: 256 samples at 44.1 kHz leave 5.8 ms.
+REALTIME_BLOCK_SIZE = 256
+
+# Bins of the histograms of the render times.
+HISTOGRAM_BINS = 50
+
+
+class NullSink:
+    """
+    Sound card which plays nothing, to measure the rendering alone.
+    """
+
+    def __init__(self):
+        self._block_count = 0
+
+    def get_block_count(self):
+        return self._block_count
+
+    def write(self, block):
+        self._block_count += 1
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    """
+    Sound card writing the blocks in a 16 bits mono .wav file, as they come
+    (see WavWriter).
+    """
+
+    def __init__(self, path, sampling_rate: int):
+        self._writer = WavWriter(path, sampling_rate, numpy.int16)
+
+    def write(self, block):
+        self._writer.write(block)
+
+    def close(self):
+        self._writer.close()
+
+
+class BlockRenderer:
+    """
+    Renders a music block by block, the way a sound card asks for it:
+    each call to render_block() gives the next block_size samples.
+
+    The voices come from a Mixer, scheduled once, and the peak of every pitch
+    is measured before the first block, so a block only synthesizes the part
+    of the voices sounding in it. The blocks can't be scaled down afterwards
+    like Mixer.mix() does, the samples which would clip are clipped (and
+    counted). The voices are mixed in the processing type, then dithered to
+    16 bits (see to_output()).
+
+    The returned block is the same array every time, overwritten by the
+    next call. The rendering itself isn't allocation-free though: each voice
+    of a block is synthesized in a new array (see Mixer.render_voice()),
+    which numpy allocates and frees, without a lock but not in a bounded time.
+    """
+
+    def __init__(
+        self,
+        instrument: InstrumentModel,
+        music,
+        block_size: int = REALTIME_BLOCK_SIZE,
+        max_voices: int = MAX_VOICES,
+        method: str = "wavetable",
+    ):
+        self._mixer = Mixer(instrument, max_voices, method=method)
+        self._voices = sorted(
+            self._mixer.schedule(music), key=lambda voice: voice.start
+        )
+        self._mixer.prepare(self._voices)
+        self._block_size = block_size
+        self._sampling_rate = instrument.get_sampling_rate()
+        self._length = max((voice.end for voice in self._voices), default=0)
+
+        self._position = 0
+        self._next_voice = 0
+        self._playing = []
+        self._clipped = 0
+        self._mix = numpy.zeros(block_size, dtype=get_processing_dtype())
+        self._block = numpy.zeros(block_size, dtype=numpy.int16)
+        self._dither = numpy.random.default_rng(DITHER_SEED)
+
+    # Getters
+    def get_block_size(self):
+        return self._block_size
+
+    def get_sampling_rate(self):
+        return self._sampling_rate
+
+    def get_length(self):
+        return self._length
+
+    def get_block_count(self):
+        return -(-self._length // self._block_size)
+
+    def get_deadline(self):
+        """
+        Seconds a block takes to play, so to render the next one.
+        """
+        return self._block_size / self._sampling_rate
+
+    def get_clipped(self):
+        """
+        Amount of samples clipped so far
+        """
+        return self._clipped
+
+    def is_finished(self):
+        return self._position >= self._length
+
+    def render_block(self):
+        """
+        Next block of samples, zeros past the end of the music.
+        """
+        first = self._position
+        last = first + self._block_size
+        self._position = last
+
+        while (
+            self._next_voice < len(self._voices)
+            and self._voices[self._next_voice].start < last
+        ):
+            self._playing.append(self._voices[self._next_voice])
+            self._next_voice += 1
+
+        self._mix.fill(0)
+        for voice in self._playing:
+            start = max(first, voice.start)
+            stop = min(last, voice.end)
+            if start < stop:
+                self._mix[start - first : stop - first] += self._mixer.render_voice(
+                    voice, start, stop
+                )
+        self._playing = [voice for voice in self._playing if voice.end > last]
+
+        limit = numpy.iinfo(numpy.int16).max
+        self._clipped += numpy.count_nonzero(numpy.abs(self._mix) > limit)
+        self._block[:] = to_output(self._mix, numpy.int16, self._dither)
+        return self._block
+
+
+class RenderStats:
+    """
+    Render time of each block of a BlockRenderer, against its deadline.
+    A block rendered after its deadline is an underrun: the sound card
+    would have played silence (or the previous block) instead.
+    """
+
+    def __init__(self, block_size: int, sampling_rate: int, block_count: int):
+        self._block_size = block_size
+        self._sampling_rate = sampling_rate
+        self._times = numpy.zeros(block_count)
+        self._count = 0
+        self._underruns = 0
+
+    # Getters
+    def get_block_size(self):
+        return self._block_size
+
+    def get_deadline(self):
+        return self._block_size / self._sampling_rate
+
+    def get_render_times(self):
+        """
+        Seconds spent rendering each block
+        """
+        return self._times[: self._count]
+
+    def get_underruns(self):
+        return self._underruns
+
+    def get_load(self):
+        """
+        Average part of the deadline spent rendering
+        """
+        if self._count == 0:
+            return 0.0
+        return float(numpy.mean(self.get_render_times())) / self.get_deadline()
+
+    def get_percentile(self, percentile: float):
+        return float(numpy.percentile(self.get_render_times(), percentile))
+
+    def record(self, duration: float, late: bool):
+        self._times[self._count] = duration
+        self._count += 1
+        if late:
+            self._underruns += 1
+
+    def histogram(self, bins: int = HISTOGRAM_BINS):
+        """
+        Counts and edges (in milliseconds) of the render times,
+        see numpy.histogram().
+        """
+        return numpy.histogram(self.get_render_times() * 1000, bins)
+
+    def export_histogram(self, path, bins: int = HISTOGRAM_BINS):
+        """
+        Writes the histogram in a .csv file, one line per bin.
+        """
+        counts, edges = self.histogram(bins)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["start_ms", "stop_ms", "blocks"])
+            for count, start, stop in zip(counts, edges, edges[1:]):
+                writer.writerow([f"{start:.6f}", f"{stop:.6f}", int(count)])
+
+    def plot_histogram(self, name: str, bins: int = HISTOGRAM_BINS):
+        plt.figure()
+        plt.hist(self.get_render_times() * 1000, bins, log=True)
+        plt.axvline(self.get_deadline() * 1000, color="red", label="Échéance")
+        plt.xlabel("Temps de rendu d'un bloc (ms)")
+        plt.ylabel("Blocs")
+        plt.legend()
+        save_plot(name)
+        plt.close()
+
+    def print_summary(self):
+        print(
+            f"{self._count} blocks of {self._block_size} samples, "
+            f"deadline {self.get_deadline() * 1000:.2f}ms: "
+            f"load {self.get_load() * 100:.1f}%, "
+            f"p99 {self.get_percentile(99) * 1000:.3f}ms, "
+            f"worst {self.get_percentile(100) * 1000:.3f}ms, "
+            f"{self._underruns} underruns"
+        )
+
+
+def render_realtime(renderer: BlockRenderer, sink, paced: bool = False):
+    """
+    Renders every block of the renderer into the sink, and times them.
+
+    Unpaced, blocks are rendered as fast as possible and a block is late when
+    it took longer than its deadline. Paced, the loop waits for the sink to
+    need each block like a sound card would (the first one being needed one
+    deadline after the start), so a late block is one finished after the
+    previous one was done playing, the time saved on the blocks before
+    included.
+    """
+    deadline = renderer.get_deadline()
+    stats = RenderStats(
+        renderer.get_block_size(),
+        renderer.get_sampling_rate(),
+        renderer.get_block_count(),
+    )
+    start = time.perf_counter()
+    index = 0
+    while not renderer.is_finished():
+        before = time.perf_counter()
+        block = renderer.render_block()
+        after = time.perf_counter()
+
+        if paced:
+            due = start + (index + 1) * deadline
+            stats.record(after - before, after > due)
+            if after < due:
+                time.sleep(due - after)
+            else:
+                # The sound card played silence meanwhile, and goes on from now
+                start = after - (index + 1) * deadline
+        else:
+            stats.record(after - before, after - before > deadline)
+        sink.write(block)
+        index += 1
+    sink.close()
+    return stats
@@ -4,6 +4,7 @@ from scipy.fft import fft, ifft
 from scipy.io import wavfile
 from scipy import signal
 from code.rawSignals import get_bassoon
+from code.convolution import PartitionedConvolver, convolve
 
 
 def gen_notch(f0=1000):
@@ -43,7 +44,7 @@ def gen_sound():
     print(f"Filter response at 1kHz: {np.abs(H_freq[freq_1khz_idx]):.6f}")
 
     # Convolve the bassoon signal with the impulse response
-    filtered_signal = np.convolve(bassoon_data, h, mode="same")
+    filtered_signal = convolve(bassoon_data, h, mode="same")
 
     # Check the frequency content of the filtered signal
     filtered_fft = fft(filtered_signal)
@@ -115,22 +116,18 @@ def gen_sound():
     return filtered_signal
 
 
-def sandbox_2():
-    """
-    Convolve guitar signal with a proper reverb impulse response (multiple reflections + exponential decay).
-    Output is saved as convolved.wav
-    """
-    # Get the guitar signal using the helper function from rawSignals
-    from code.rawSignals import get_guitar
+# Early reflections of the reverb: delay (s) and gain.
+# Includes immediate reflections to avoid a dry gap.
+REFLECTION_DELAYS = [0.005, 0.012, 0.025, 0.045, 0.070, 0.100, 0.140]
+REFLECTION_GAINS = [0.4, 0.5, 0.6, 0.4, 0.3, 0.25, 0.2]
 
-    guitar_signal = get_guitar()
-    guitar_data = guitar_signal.get_signal()
-    fs = guitar_signal.get_sampling_rate()
 
-    print(f"Guitar signal: {len(guitar_data)} samples at {fs} Hz")
-
-    # Create a proper reverb impulse response over 4 seconds
-    duration_s = 4.0  # 4 seconds reverb tail
+def build_reverb_impulse(fs=44100, duration_s=4.0):
+    """
+    Reverb impulse response: the direct sound, a few early reflections
+    and an exponentially decaying white noise for the diffuse tail.
+    Seeded, so it's always the same impulse.
+    """
     num_samples = int(fs * duration_s)
 
     # Create time array
@@ -149,20 +146,8 @@ def sandbox_2():
 
     # 4. Add early reflections (including some immediate ones)
     early_reflections = np.zeros(num_samples)
-
-    # Include immediate reflections to avoid dry gap
-    reflection_delays = [
-        int(0.005 * fs),  # 5ms - very early reflection
-        int(0.012 * fs),  # 12ms
-        int(0.025 * fs),  # 25ms
-        int(0.045 * fs),  # 45ms
-        int(0.070 * fs),  # 70ms
-        int(0.100 * fs),  # 100ms
-        int(0.140 * fs),  # 140ms
-    ]
-    reflection_gains = [0.4, 0.5, 0.6, 0.4, 0.3, 0.25, 0.2]
-
-    for delay, gain in zip(reflection_delays, reflection_gains):
+    for delay, gain in zip(REFLECTION_DELAYS, REFLECTION_GAINS):
+        delay = int(delay * fs)
         if delay < num_samples:
             early_reflections[delay] = gain
 
@@ -177,14 +162,43 @@ def sandbox_2():
 
     # Add diffuse tail starting from beginning (but builds up over time)
     final_impulse += reverb_tail
+    return final_impulse
+
+
+def get_live_reverb(fs=44100, block_size=256):
+    """
+    The reverb of sandbox_2(), to apply on live audio blocks of block_size samples
+    through its process() method.
+    """
+    return PartitionedConvolver(build_reverb_impulse(fs), block_size)
+
+
+def sandbox_2():
+    """
+    Convolve guitar signal with a proper reverb impulse response (multiple reflections + exponential decay).
+    Output is saved as convolved.wav
+    """
+    # Get the guitar signal using the helper function from rawSignals
+    from code.rawSignals import get_guitar
+
+    guitar_signal = get_guitar()
+    guitar_data = guitar_signal.get_signal()
+    fs = guitar_signal.get_sampling_rate()
+
+    print(f"Guitar signal: {len(guitar_data)} samples at {fs} Hz")
+
+    # Create a proper reverb impulse response over 4 seconds
+    duration_s = 4.0  # 4 seconds reverb tail
+    final_impulse = build_reverb_impulse(fs, duration_s)
+    tau = duration_s / 4.6  # Decay time constant, same as in the impulse
 
     print(f"Reverb impulse: {len(final_impulse)} samples ({duration_s} s)")
-    print(f"Early reflections: {len(reflection_delays)} discrete reflections")
-    print(f"First reflection at: {reflection_delays[0] / fs * 1000:.1f} ms")
+    print(f"Early reflections: {len(REFLECTION_DELAYS)} discrete reflections")
+    print(f"First reflection at: {REFLECTION_DELAYS[0] * 1000:.1f} ms")
     print(f"Decay time constant τ = {tau:.3f} s")
 
     # Convolve the guitar signal with the reverb impulse
-    convolved_signal = np.convolve(guitar_data, final_impulse, mode="full")
+    convolved_signal = convolve(guitar_data, final_impulse, mode="full")
 
     print(f"Convolved signal: {len(convolved_signal)} samples")
 
@@ -217,33 +231,7 @@ def plot_reverb_analysis():
     # Create time array
     t = np.linspace(0, duration_s, num_samples)
 
-    # Generate the same reverb impulse
-    np.random.seed(42)  # Same seed for reproducibility
-    noise = np.random.randn(num_samples)
-    tau = duration_s / 4.6
-    decay_envelope = np.exp(-t / tau)
-    reverb_tail = noise * decay_envelope * 0.2
-
-    early_reflections = np.zeros(num_samples)
-    reflection_delays = [
-        int(0.005 * fs),
-        int(0.012 * fs),
-        int(0.025 * fs),
-        int(0.045 * fs),
-        int(0.070 * fs),
-        int(0.100 * fs),
-        int(0.140 * fs),
-    ]
-    reflection_gains = [0.4, 0.5, 0.6, 0.4, 0.3, 0.25, 0.2]
-
-    for delay, gain in zip(reflection_delays, reflection_gains):
-        if delay < num_samples:
-            early_reflections[delay] = gain
-
-    final_impulse = np.zeros(num_samples)
-    final_impulse[0] = 1.0
-    final_impulse += early_reflections
-    final_impulse += reverb_tail
+    final_impulse = build_reverb_impulse(fs, duration_s)
 
     # Compute frequency response
     impulse_fft = fft(final_impulse)
@@ -1,25 +1,172 @@
+import hashlib
+import json
+import pickle
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
 
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+import numpy
+from matplotlib.collections import Collection
+from matplotlib.lines import Line2D
+from matplotlib.text import Text
 
 # mpl.rcParams["font.family"] = "CMU Serif"
 mpl.rcParams["mathtext.fontset"] = "cm"
 
 DIRECTORY_PATH = Path("./graphs")
 
+# Every figure is exported in 16:9.
+FIGURE_SIZE = (16, 9)
 
-def save_plot(name: str):
+# Amount of processes rendering figures in the background, None for one per core.
+# 0 renders the figures right away, in this process.
+PLOT_WORKERS = None
+
+# Hash of the figures already exported, so unchanged ones aren't rendered again.
+MANIFEST_PATH = Path("./.cache/figures.json")
+
+_executor = None
+_pending = []
+_lock = threading.Lock()
+
+
+def save_plot(name: str) -> Future:
     """
     Does the annoying bit of saving matplotlib figures.
     Automatically creates the output path if it doesn't
     exist. Includes the file format for you.
 
+    The current figure is copied and rendered to .svg and .pdf by a
+    background process, so you can close it (or keep drawing) right away.
+    A figure whose data and style didn't change since it was last exported
+    isn't rendered again.
+
     :param name: Name for the figure, don't include any file extension.
     :type name: str
+    :return: Completed once both files are written. wait_for_plots() waits for all of them.
     """
     DIRECTORY_PATH.mkdir(parents=True, exist_ok=True)
-    plt.savefig(DIRECTORY_PATH / f"{name}.svg", bbox_inches="tight")
-    plt.tight_layout()
-    plt.rcParams["figure.figsize"] = (16, 9)
-    plt.savefig(DIRECTORY_PATH / f"{name}.pdf", pad_inches=0.1)
+    figure = plt.gcf()
+    rc = {
+        key: mpl.rcParams[key]
+        for key in ("font.family", "font.serif", "mathtext.fontset")
+    }
+    digest = figure_hash(figure, rc)
+
+    with _lock:
+        manifest = _read_manifest()
+    paths = [DIRECTORY_PATH / f"{name}.svg", DIRECTORY_PATH / f"{name}.pdf"]
+    if manifest.get(name) == digest and all(path.exists() for path in paths):
+        skipped = Future()
+        skipped.set_result(None)
+        return skipped
+
+    pickled = pickle.dumps(figure)
+    if PLOT_WORKERS == 0:
+        future = Future()
+        _render(pickled, rc, paths)
+        future.set_result(None)
+    else:
+        future = _get_executor().submit(_render, pickled, rc, paths)
+
+    future.add_done_callback(lambda done: _remember(done, name, digest))
+    with _lock:
+        _pending.append(future)
+    return future
+
+
+def wait_for_plots():
+    """
+    Waits until every figure given to save_plot() is written.
+    Errors of the background renders are raised here.
+    """
+    with _lock:
+        pending = list(_pending)
+        _pending.clear()
+    for future in pending:
+        future.result()
+
+
+def figure_hash(figure, rc: dict | None = None) -> str:
+    """
+    Hash of what's drawn on the figure: the data and style of its lines,
+    collections and texts (grid and ticks included), its axes and the rcParams
+    used to render it.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+
+    def add(*values):
+        digest.update(repr(values).encode())
+
+    add(rc, FIGURE_SIZE)
+    for axes in figure.get_axes():
+        add(
+            "axes",
+            axes.get_position().bounds,
+            axes.get_xlim(),
+            axes.get_ylim(),
+            axes.get_xscale(),
+            axes.get_yscale(),
+        )
+    for artist in figure.findobj():
+        if not artist.get_visible():
+            continue
+        if isinstance(artist, Line2D):
+            digest.update(numpy.ascontiguousarray(artist.get_xydata()).tobytes())
+            add(
+                "line",
+                artist.get_label(),
+                artist.get_color(),
+                artist.get_linestyle(),
+                artist.get_linewidth(),
+                artist.get_marker(),
+                artist.get_zorder(),
+            )
+        elif isinstance(artist, Collection):
+            digest.update(numpy.ascontiguousarray(artist.get_offsets()).tobytes())
+            # Colour-mapped data (pcolormesh, scatter with c=...)
+            if artist.get_array() is not None:
+                digest.update(numpy.ascontiguousarray(artist.get_array()).tobytes())
+            add("collection", artist.get_label(), artist.get_facecolor().tobytes())
+        elif isinstance(artist, Text):
+            add("text", artist.get_text(), artist.get_position(), artist.get_fontsize())
+    return digest.hexdigest()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=PLOT_WORKERS, initializer=mpl.use, initargs=("Agg",)
+            )
+        return _executor
+
+
+def _render(pickled, rc, paths):
+    figure = pickle.loads(pickled)
+    with mpl.rc_context(rc):
+        figure.set_size_inches(*FIGURE_SIZE)
+        svg_path, pdf_path = paths
+        figure.savefig(svg_path, bbox_inches="tight")
+        figure.tight_layout()
+        figure.savefig(pdf_path, pad_inches=0.1)
+    plt.close(figure)
+
+
+def _remember(future, name, digest):
+    if future.exception() is not None:
+        return
+    with _lock:
+        manifest = _read_manifest()
+        manifest[name] = digest
+        MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+        MANIFEST_PATH.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def _read_manifest():
+    if not MANIFEST_PATH.exists():
+        return {}
+    return json.loads(MANIFEST_PATH.read_text())
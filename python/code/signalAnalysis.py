@@ -1,49 +1,208 @@
+from code.decimation import plot_decimated
 from code.saveFigure import save_plot
 from code.signalFFT import SignalFFT
 from code.wavSignal import WavSignal
 
 import matplotlib.pyplot as plt
 import numpy
-import scipy.signal as sp
+from numpy.lib.stride_tricks import sliding_window_view
 
+# Range of the fundamentals looked for, in Hz. The lowest keeps the DC peak
+# of the spectrum (huge for rectified signals) out of the estimation.
+LOWEST_FUNDAMENTAL = 50
+HIGHEST_FUNDAMENTAL = 2000
 
-def get_harmonics(
-    signal: WavSignal,
+# Harmonics multiplied together to estimate the fundamental
+# (harmonic product spectrum).
+FUNDAMENTAL_HARMONICS = 5
+
+# Half width of the window searched around each expected harmonic,
+# as a fraction of the fundamental. Well under a half, so the windows of
+# neighbouring harmonics don't touch and a strong one isn't picked twice.
+HARMONIC_WINDOW = 0.25
+
+
+def get_harmonics(signal: WavSignal, amount_to_get: int = 32):
+    """
+    Frequency indexes and amplitudes of the first harmonics of the signal,
+    both refined between the bins (see detect_harmonics()), so the indexes
+    are fractional: use SignalFFT.get_frequencies_at() to get them in Hz.
+    Use plot_harmonics() to draw them.
+    """
+    fft = SignalFFT(signal)
+    lowest_index, highest_index = _fundamental_range(signal)
+    _, peaks_indexes, peaks = detect_harmonics(
+        fft.get_amplitudes(),
+        amount_to_get,
+        lowest_index=lowest_index,
+        highest_index=highest_index,
+    )
+    peaks_indexes = peaks_indexes[0]
+    peaks = peaks[0]
+
+    print(f"{amount_to_get} harmonics analysis of {signal.get_name()}")
+    print(f"\t- Frequency indexes:   {peaks_indexes}")
+    print(f"\t- Harmonic amplitudes: {peaks}")
+
+    return peaks_indexes, peaks
+
+
+def get_harmonics_of_signals(signals, amount_to_get: int = 32):
+    """
+    Same as get_harmonics() for many signals of the same length at once.
+
+    :return: Frequency indexes, refined frequencies (Hz) and amplitudes,
+        one row per signal
+    """
+    spectra = numpy.stack([SignalFFT(signal).get_amplitudes() for signal in signals])
+    lowest_index, highest_index = _fundamental_range(signals[0])
+    indexes, positions, peaks = detect_harmonics(
+        spectra,
+        amount_to_get,
+        lowest_index=lowest_index,
+        highest_index=highest_index,
+    )
+    bin_width = signals[0].get_sampling_rate() / signals[0].get_sample_count()
+    return indexes, positions * bin_width, peaks
+
+
+def _fundamental_range(signal: WavSignal):
+    """
+    Frequency indexes of LOWEST_FUNDAMENTAL and HIGHEST_FUNDAMENTAL
+    in the spectrum of the signal
+    """
+    bin_width = signal.get_sampling_rate() / signal.get_sample_count()
+    return (
+        int(numpy.ceil(LOWEST_FUNDAMENTAL / bin_width)),
+        int(HIGHEST_FUNDAMENTAL / bin_width),
+    )
+
+
+def estimate_fundamental_index(
+    spectra, lowest_index: int = 1, highest_index: int | None = None
+):
+    """
+    Frequency index of the fundamental of each spectrum (one per row),
+    where the first harmonics line up the most (harmonic product spectrum).
+    """
+    spectra = numpy.atleast_2d(spectra)
+    candidates = spectra.shape[1] // FUNDAMENTAL_HARMONICS
+    if highest_index is not None:
+        candidates = min(candidates, highest_index + 1)
+    log_product = numpy.zeros((spectra.shape[0], candidates))
+    for harmonic in range(1, FUNDAMENTAL_HARMONICS + 1):
+        log_product += numpy.log(
+            spectra[:, : candidates * harmonic : harmonic] + numpy.finfo(float).tiny
+        )
+    return lowest_index + numpy.argmax(log_product[:, lowest_index:], axis=1)
+
+
+def detect_harmonics(
+    spectra,
     amount_to_get: int = 32,
-    sample_distance_between_peaks: int = 1285,
+    fundamental_indexes=None,
+    lowest_index: int = 1,
+    highest_index: int | None = None,
 ):
-    start = 1
-    end = amount_to_get + 1
+    """
+    Finds the first harmonics of amplitude spectra, one spectrum per row.
+
+    The fundamental is estimated first (see estimate_fundamental_index()),
+    then each harmonic is the highest bin of a narrow window around where
+    it's expected: the window of harmonic k is centered on k times the
+    spacing measured so far, so it follows a string slightly out of tune
+    with itself. Every spectrum is processed at once.
+
+    The position and amplitude of each peak are refined between bins, by
+    fitting a parabola through the log amplitudes of the peak and its two
+    neighbours.
+
+    :param fundamental_indexes: Frequency index of each fundamental,
+        estimated when not given.
+    :param lowest_index: Lowest fundamental looked for, as a frequency index.
+    :param highest_index: Highest fundamental looked for, as a frequency index.
+    :return: Frequency indexes, refined (fractional) frequency indexes and
+        refined amplitudes of the harmonics, one row per spectrum.
+    """
+    spectra = numpy.atleast_2d(spectra)
+    count, length = spectra.shape
+    rows = numpy.arange(count)
 
-    # Obtaining the amplitudes of each frequencies of the signal.
-    fft = SignalFFT(signal)
-    amplitudes = fft.get_amplitudes()
+    if fundamental_indexes is None:
+        fundamental_indexes = estimate_fundamental_index(
+            spectra, lowest_index, highest_index
+        )
+    spacing = numpy.asarray(fundamental_indexes, dtype=numpy.float64).reshape(count)
+    half_widths = numpy.maximum(numpy.round(spacing * HARMONIC_WINDOW), 1)
+    width = int(half_widths.max())
+
+    # Every window is a view on the padded spectra, the padding and the DC
+    # bin are never picked. Spectra with a higher fundamental have wider
+    # windows, the columns others don't search are masked.
+    padded = numpy.pad(
+        spectra.astype(numpy.float64),
+        ((0, 0), (width, width)),
+        constant_values=-numpy.inf,
+    )
+    padded[:, width] = -numpy.inf
+    windows = sliding_window_view(padded, 2 * width + 1, axis=1)
+    outside = numpy.abs(numpy.arange(-width, width + 1))[None, :] > half_widths[:, None]
+
+    indexes = numpy.zeros((count, amount_to_get), dtype=numpy.int64)
+    for k in range(1, amount_to_get + 1):
+        centers = numpy.clip(
+            numpy.round(spacing * k).astype(numpy.int64), 0, length - 1
+        )
+        values = windows[rows, centers]
+        if outside.any():
+            values = numpy.where(outside, -numpy.inf, values)
+        indexes[:, k - 1] = centers - width + numpy.argmax(values, axis=1)
+        spacing = indexes[:, k - 1] / k
+
+    offsets, peaks = _parabolic_peaks(spectra, indexes)
+    return indexes, indexes + offsets, peaks
 
-    local_peaks, _ = sp.find_peaks(amplitudes, distance=sample_distance_between_peaks)
 
-    peaks_indexes = local_peaks[start:end]
-    peaks = amplitudes[peaks_indexes]
+def _parabolic_peaks(spectra, indexes):
+    """
+    Offset (between -0.5 and 0.5 bin) and amplitude of the top of the
+    parabola through the log amplitudes around each peak.
+    """
+    rows = numpy.arange(spectra.shape[0])[:, None]
+    tiny = numpy.finfo(float).tiny
+    left = numpy.log(spectra[rows, numpy.maximum(indexes - 1, 0)] + tiny)
+    center = numpy.log(spectra[rows, indexes] + tiny)
+    right = numpy.log(
+        spectra[rows, numpy.minimum(indexes + 1, spectra.shape[1] - 1)] + tiny
+    )
+    curvature = left - 2 * center + right
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        offsets = 0.5 * (left - right) / curvature
+    offsets = numpy.clip(numpy.nan_to_num(offsets), -0.5, 0.5)
+    return offsets, numpy.exp(center - 0.25 * (left - right) * offsets)
+
+
+def plot_harmonics(signal: WavSignal, peaks_indexes, peaks):
+    """
+    Spectrum of the signal (dB) with its harmonics marked,
+    see get_harmonics().
+    """
+    amplitudes = SignalFFT(signal).get_amplitudes()
 
     plt.figure()
     # plt.title("Harmonics identification")
     plt.xlabel("index de fréquence (m)")
     plt.ylabel("Amplitude (dB)")
     plt.xlim(0, 70000)
-    plt.plot(20 * numpy.log10(amplitudes))
+    plot_decimated(None, 20 * numpy.log10(amplitudes))
     plt.plot(
         peaks_indexes,
         20 * numpy.log10(peaks),
         "xr",
     )
-    save_plot(f"{amount_to_get} harmonics of {signal.get_name()}")
+    save_plot(f"{len(peaks_indexes)} harmonics of {signal.get_name()}")
     plt.close()
 
-    print(f"{amount_to_get} harmonics analysis of {signal.get_name()}")
-    print(f"\t- Frequency indexes:   {peaks_indexes}")
-    print(f"\t- Harmonic amplitudes: {peaks}")
-
-    return peaks_indexes, peaks
-
 
 def print_harmonics(original_signal: WavSignal, peaks_indexes, peaks):
     """
@@ -59,8 +218,8 @@ def print_harmonics(original_signal: WavSignal, peaks_indexes, peaks):
     for index in peaks_indexes:
         amplitude = peaks[current_harmonic]
         amplitude = 20 * numpy.log10(amplitude)
-        frequency = fft.get_frequencies_axis()[index]
-        phase = fft.get_phases()[index]
+        frequency = fft.get_frequencies_at(index)
+        phase = fft.get_phases_at(index)
 
         current_harmonic += 1
         print(
@@ -78,6 +237,6 @@ def get_fondamental_harmonic_frequency(original_signal: WavSignal, peaks_indexes
     """
     fft = SignalFFT(original_signal)
 
-    first_harmonic = fft.get_frequencies_axis()[peaks_indexes[0]]
+    first_harmonic = float(fft.get_frequencies_at(peaks_indexes[0]))
     print(f"The fundamental of {original_signal.get_name()} is {first_harmonic}Hz")
     return first_harmonic
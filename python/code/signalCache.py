@@ -0,0 +1,49 @@
+import os
+import threading
+from code.cache import ByteBudgetCache
+from code.dtypePolicy import get_processing_dtype
+from code.wavSignal import WavSignal
+
+# 256 MB of decoded samples is plenty for the recordings of this project.
+MAX_CACHED_BYTES = 256 * 1024 * 1024
+
+_cache = ByteBudgetCache(MAX_CACHED_BYTES)
+_lock = threading.Lock()
+
+
+def load_signal(path: str) -> WavSignal:
+    """
+    Returns a WavSignal of the given .wav file, reading it from disk
+    only the first time (or when the file changed since).
+
+    The returned WavSignal is a view on the cached samples: they are
+    read-only and every modification goes through set_signal(), which
+    replaces the array instead of writing into it. The cached data
+    can therefore never be corrupted by the caller.
+    """
+    stat = os.stat(path)
+    key = (
+        os.path.abspath(path),
+        stat.st_mtime_ns,
+        stat.st_size,
+        get_processing_dtype().str,
+    )
+
+    with _lock:
+        cached = _cache.get(key)
+        if cached is None:
+            cached = WavSignal(path)
+            cached.get_signal().flags.writeable = False
+            _cache.put(key, cached, cached.get_signal().nbytes)
+
+    return cached.view()
+
+
+def clear_signal_cache():
+    with _lock:
+        _cache.clear()
+
+
+def set_signal_cache_size(max_bytes: int):
+    with _lock:
+        _cache.set_max_bytes(max_bytes)
@@ -1,57 +1,143 @@
+import hashlib
+import threading
+from code.artifactCache import array_hash, cached_arrays
+from code.cache import ByteBudgetCache
+from code.decimation import PLOT_RESOLUTION, plot_decimated
+from code.dtypePolicy import to_processing
 from code.saveFigure import save_plot
 from code.wavSignal import WavSignal
 
 import matplotlib.pyplot as plt
 import numpy
+import scipy.fft
+
+# Spectra already computed, shared between every SignalFFT of the same samples.
+MAX_CACHED_BYTES = 256 * 1024 * 1024
+_cache = ByteBudgetCache(MAX_CACHED_BYTES)
+_lock = threading.Lock()
 
 
 class SignalFFT:
     """
     Class which purpose is to contain the FFT of a WavSignal.
     It does everything for you, including plotting.
+
+    The FFT is shared between every SignalFFT built over the same samples,
+    so building one again on an unchanged signal costs a hash of its samples.
+    Amplitudes and phases are only computed the first time they're asked for.
+    The samples are transformed in the processing type (see code.dtypePolicy),
+    a float32 signal giving a complex64 spectrum.
+
+    :param workers: When given, scipy.fft is used with that many workers
+        (-1 for all cores) instead of numpy.fft. float32 samples always
+        go through scipy.fft, numpy.fft would transform them in float64.
+    :param fast_length: Zero-pads the signal to the next fast FFT length.
+        The frequency axis follows the padded length.
+    :param persistent: The FFT is also kept on disk, so it's only computed
+        once across runs (see artifactCache).
     """
 
-    def __init__(self, signal: WavSignal):
+    def __init__(
+        self,
+        signal: WavSignal,
+        workers: int | None = None,
+        fast_length: bool = False,
+        persistent: bool = False,
+    ):
         self._ogSignal = signal
 
-        fft = numpy.fft.rfft(signal.get_signal())
-
-        frequencies = numpy.fft.rfftfreq(
-            signal.get_sample_count(), d=(1 / signal.get_sampling_rate())
+        samples = numpy.ascontiguousarray(to_processing(signal.get_signal()))
+        length = signal.get_sample_count()
+        use_scipy = workers is not None or samples.dtype == numpy.float32
+        if fast_length:
+            length = scipy.fft.next_fast_len(length, real=True)
+
+        key = (
+            hashlib.blake2b(samples.view(numpy.uint8), digest_size=16).digest(),
+            samples.dtype.str,
+            samples.shape,
+            signal.get_sampling_rate(),
+            length,
+            use_scipy,
         )
-        amplitudes = numpy.abs(fft)
-        phases = numpy.angle(fft)
 
-        # TODO: How the fuck do I only keep the 32 most important harmonics without fucking up the graphs?!
-        self._frequencies = frequencies
-        self._amplitudes = amplitudes
-        self._phases = phases
-        self._fft = fft
+        def compute():
+            if not use_scipy:
+                return {"fft": numpy.fft.rfft(samples, n=length)}
+            return {"fft": scipy.fft.rfft(samples, n=length, workers=workers)}
+
+        # Looked up and stored at once, so every SignalFFT of the same
+        # samples shares the same entry, even built from several threads.
+        with _lock:
+            entry = _cache.get(key)
+            if entry is None:
+                if persistent:
+                    parameters = {"length": length, "scipy": use_scipy}
+                    computed = cached_arrays(
+                        "fft", [array_hash(samples)], parameters, compute
+                    )
+                else:
+                    computed = compute()
+                fft = computed["fft"]
+                frequencies = numpy.fft.rfftfreq(
+                    length, d=(1 / signal.get_sampling_rate())
+                )
+                fft.flags.writeable = False
+                frequencies.flags.writeable = False
+                entry = {"fft": fft, "frequencies": frequencies}
+                # The amplitudes and phases added later take as much as the fft.
+                _cache.put(key, entry, 2 * fft.nbytes + frequencies.nbytes)
+
+        self._entry = entry
+
+    def _lazy(self, name, compute):
+        # The entry is shared with the other threads, like the cache itself.
+        with _lock:
+            value = self._entry.get(name)
+            if value is None:
+                value = compute(self._entry["fft"])
+                value.flags.writeable = False
+                self._entry[name] = value
+        return value
 
     # Getters
     def get_amplitudes(self):
         """
         Obtain an array of amplitudes for each frequencies of the FFT
         """
-        return self._amplitudes
+        return self._lazy("amplitudes", numpy.abs)
 
     def get_frequencies_axis(self):
         """
         The x axis of frequencies used when plotting graphs for ffts
         """
-        return self._frequencies
+        return self._entry["frequencies"]
+
+    def get_frequencies_at(self, indexes):
+        """
+        Frequencies of fractional indexes of the FFT, like the refined
+        harmonics of get_harmonics(), between the bins of the axis.
+        """
+        frequencies = self.get_frequencies_axis()
+        return numpy.interp(indexes, numpy.arange(len(frequencies)), frequencies)
 
     def get_phases(self):
         """
         Obtain an array of phases for each frequencies of the FFT
         """
-        return self._phases
+        return self._lazy("phases", numpy.angle)
+
+    def get_phases_at(self, indexes):
+        """
+        Phases of the bins nearest to fractional indexes of the FFT.
+        """
+        return self.get_phases()[numpy.rint(indexes).astype(numpy.int64)]
 
     def get_fft(self):
         """
         Obtain the FFT of the given signal.
         """
-        return self._fft
+        return self._entry["fft"]
 
     def get_signal(self):
         """
@@ -67,31 +153,39 @@ class SignalFFT:
         print(f"\t - Amount of sins kept:    {self._sinKept}")
         print(f"\t - Size of frequency axis: {len(self.get_frequencies_axis())}")
 
-    def partial_phase_plot(self):
+    def partial_phase_plot(self, resolution: int = PLOT_RESOLUTION):
         """
         Integrates this fft's phases within a larger plot.
         You handle the business, but this essentially
         does the plt for you so you dont have to mess
         with the getters.
+        The phases are decimated to the resolution (None to plot all of them).
         """
-        plt.plot(self.get_frequencies_axis(), self.get_phases(), label="Phases")
+        plot_decimated(
+            self.get_frequencies_axis(),
+            self.get_phases(),
+            label="Phases",
+            resolution=resolution,
+        )
         # plt.title(f"Spectre de phases de {self.get_signal().get_name()}")
         plt.xlabel("Fréquence (Hz)")
         plt.ylabel("Phase (rad)")
         plt.legend()
         plt.grid(True)
 
-    def partial_amplitude_plot(self):
+    def partial_amplitude_plot(self, resolution: int = PLOT_RESOLUTION):
         """
         Integrates this fft's amplitude within a larger plot.
         You handle the business, but this essentially
         does the plt for you so you dont have to mess
         with the getters.
+        The amplitudes are decimated to the resolution (None to plot all of them).
         """
-        plt.plot(
+        plot_decimated(
             self.get_frequencies_axis(),
             self.get_amplitudes(),
             label="Amplitudes",
+            resolution=resolution,
         )
         # plt.title(f"Spectre fréquentielle de {self.get_signal().get_name()}")
         plt.xlabel("Fréquence (Hz)")
@@ -120,3 +214,8 @@ class SignalFFT:
             save_plot(f"full_fft_{self.get_signal().get_name()}")
 
         plt.close()
+
+
+def clear_fft_cache():
+    with _lock:
+        _cache.clear()
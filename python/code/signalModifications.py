@@ -1,3 +1,5 @@
+from code.convolution import mode_bounds
+from code.dtypePolicy import get_processing_dtype, to_processing
 from code.wavSignal import WavSignal
 
 import numpy
@@ -6,9 +8,10 @@ import numpy
 def apply_absolute(signal: WavSignal, newName: str = None):
     """
     Transforms a WavSignal object into its absolute.
-    Direct application of the absolute.
+    Direct application of the absolute, in the processing type: the absolute
+    of -32768 doesn't fit in 16 bits.
     """
-    signal.set_signal(numpy.abs(signal.get_signal()))
+    signal.set_signal(numpy.abs(to_processing(signal.get_signal())))
 
     if newName is None:
         signal.set_name(f"abs of {signal.get_name()}")
@@ -44,16 +47,71 @@ def trim_samples(signal: WavSignal, trim_start=0, trim_end=0):
     signal.set_signal(signal.get_signal()[start:end])
 
 
+def moving_average(samples, coefficient_order: int, mode: str = "full"):
+    """
+    Sliding average of the samples, the same as numpy.convolve with a box of
+    coefficient_order samples of 1/N, in linear time whatever the order.
+
+    Every output sample is a difference of two cumulative sums. Integer
+    samples are summed exactly in int64. Float samples are centered on
+    their mean before being summed in float64, so the sums stay small and
+    don't drift on long signals. The mean is added back at the end, and the
+    result is in the processing type (see code.dtypePolicy).
+
+    :param mode: "full", "same" or "valid", like numpy.convolve
+    """
+    samples = numpy.asarray(samples)
+    coefficient_order = int(coefficient_order)
+    length = len(samples)
+    if coefficient_order < 1 or length == 0:
+        raise ValueError("moving_average needs samples and a positive order")
+
+    # Sum of the samples before each index, from -order to length + order:
+    # the windows crossing the ends are then slices, like the others.
+    order = coefficient_order
+    integer = numpy.issubdtype(samples.dtype, numpy.integer)
+    cumulative = numpy.empty(
+        length + 1 + 2 * order, dtype=numpy.int64 if integer else numpy.float64
+    )
+    cumulative[: order + 1] = 0
+    sums = cumulative[order + 1 : order + 1 + length]
+    offset = 0.0
+    if integer:
+        numpy.cumsum(samples, dtype=numpy.int64, out=sums)
+    else:
+        offset = numpy.mean(samples, dtype=numpy.float64)
+        numpy.subtract(samples, offset, out=sums)
+        numpy.cumsum(sums, out=sums)
+    cumulative[order + 1 + length :] = cumulative[order + length]
+
+    first, last = mode_bounds(length, order, mode)
+    window_sums = cumulative[first + 1 + order : last + 1 + order]
+    window_sums = window_sums - cumulative[first + 1 : last + 1]
+    if offset != 0:
+        # Amount of samples in each window, fewer at the ends
+        counts = numpy.arange(first + 1, last + 1, dtype=numpy.float64)
+        starts = counts - order
+        numpy.maximum(starts, 0, out=starts)
+        numpy.minimum(counts, length, out=counts)
+        counts -= starts
+        counts *= offset
+        window_sums += counts
+
+    averaged = numpy.empty(len(window_sums), dtype=get_processing_dtype())
+    numpy.divide(
+        window_sums, order, out=averaged, dtype=numpy.float64, casting="same_kind"
+    )
+    return averaged
+
+
 def apply_sliding_average_low_pass_filter(
     signal: WavSignal, coefficient_order: int, new_signal_name: str
 ):
     """
-    Apply the impulse response of a filter to
-    a signal.
+    Apply the impulse response of a sliding average filter to
+    a signal (full convolution, the filter tail is kept).
     """
-    # Need an array of impulse responses
-    impulse_response = numpy.ones(int(coefficient_order)) * (1 / coefficient_order)
-    filtered = numpy.convolve(impulse_response, signal.get_signal())
+    filtered = moving_average(signal.get_signal(), coefficient_order, "full")
     signal.set_signal(filtered)
     signal.set_name(new_signal_name)
 
@@ -68,5 +126,5 @@ def apply_gain(signal: WavSignal, gain: float):
     :type gain: float
     """
     print(f"Applying x{gain} gain to signal: {signal.get_name()}")
-    gained_signal = signal.get_signal() * gain
+    gained_signal = to_processing(signal.get_signal()) * gain
     signal.set_signal(gained_signal)
@@ -0,0 +1,266 @@
+from code.saveFigure import save_plot
+from code.wavSignal import WavSignal
+
+import matplotlib.pyplot as plt
+import numpy
+import scipy.fft
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import get_window
+
+# Frames transformed at once by stream(), bounds the memory used.
+FRAMES_PER_BATCH = 256
+
+
+class SignalSTFT:
+    """
+    Class which purpose is to contain the short-time Fourier transform
+    of a WavSignal: the spectrum of each frame of frame_size samples,
+    one frame every hop samples.
+
+    Frames are centered: the first one is centered on the first sample,
+    the signal being padded with zeros on both ends (only the frames
+    touching the ends are copied, the others are strided views of the
+    samples). With a memory-mapped WavSignal and stream(), files larger
+    than the memory can be analysed, FRAMES_PER_BATCH frames at a time.
+
+    :param window: Any window scipy.signal.get_window() knows. With the
+        default hann window, hop must be at most half the frame to be able
+        to invert the STFT.
+    :param workers: Workers of scipy.fft for each batch of frames,
+        -1 for all cores.
+    """
+
+    def __init__(
+        self,
+        signal: WavSignal,
+        frame_size: int = 2048,
+        hop: int = 512,
+        window="hann",
+        workers: int | None = None,
+    ):
+        if frame_size % hop != 0:
+            raise ValueError(f"hop ({hop}) must divide frame_size ({frame_size})")
+        self._ogSignal = signal
+        self._frame_size = frame_size
+        self._hop = hop
+        self._window = get_window(window, frame_size)
+        self._workers = workers
+        self._pad = frame_size // 2
+        self._stft = None
+
+    # Getters
+    def get_frame_size(self):
+        return self._frame_size
+
+    def get_hop(self):
+        return self._hop
+
+    def get_window(self):
+        return self._window
+
+    def get_signal(self):
+        """
+        Get the signal you originally gave to this object, to access its metadata
+        """
+        return self._ogSignal
+
+    def get_frame_count(self):
+        """
+        Amount of frames needed to cover every sample
+        """
+        covered = self._ogSignal.get_sample_count() + 2 * self._pad - self._frame_size
+        return 1 + max(0, -(-covered // self._hop))
+
+    def get_frequencies_axis(self):
+        return numpy.fft.rfftfreq(
+            self._frame_size, d=1 / self._ogSignal.get_sampling_rate()
+        )
+
+    def get_times_axis(self):
+        """
+        Time (in seconds) of the center of each frame
+        """
+        return (
+            numpy.arange(self.get_frame_count())
+            * self._hop
+            / self._ogSignal.get_sampling_rate()
+        )
+
+    def get_stft(self):
+        """
+        Spectrum of every frame (frames x frequencies), computed once.
+        For long signals, prefer stream().
+        """
+        if self._stft is None:
+            stft = numpy.empty(
+                (self.get_frame_count(), self._frame_size // 2 + 1),
+                dtype=numpy.complex128,
+            )
+            for first, spectra in self.stream():
+                stft[first : first + len(spectra)] = spectra
+            stft.flags.writeable = False
+            self._stft = stft
+        return self._stft
+
+    def get_amplitudes(self):
+        return numpy.abs(self.get_stft())
+
+    def get_frames(self, first: int, last: int):
+        """
+        Windowed samples of the frames between first and last.
+        """
+        samples = self._ogSignal.get_signal()
+        count = len(samples)
+        frames = numpy.empty((last - first, self._frame_size))
+
+        starts = numpy.arange(first, last) * self._hop - self._pad
+        inside = (starts >= 0) & (starts + self._frame_size <= count)
+        if inside.any():
+            view = sliding_window_view(samples, self._frame_size)
+            rows = numpy.flatnonzero(inside)
+            numpy.multiply(
+                view[starts[rows[0]] : starts[rows[-1]] + 1 : self._hop],
+                self._window,
+                out=frames[rows[0] : rows[-1] + 1],
+            )
+
+        # Frames overlapping the ends are zero-padded one by one
+        for row in numpy.flatnonzero(~inside):
+            start = starts[row]
+            frame = numpy.zeros(self._frame_size)
+            available = samples[max(start, 0) : max(start + self._frame_size, 0)]
+            frame[max(-start, 0) : max(-start, 0) + len(available)] = available
+            frames[row] = frame * self._window
+        return frames
+
+    def stream(self, frames_per_batch: int = FRAMES_PER_BATCH):
+        """
+        Yields (index of the first frame, spectra of the frames) for each batch
+        of frames, without ever holding the whole STFT.
+        """
+        frame_count = self.get_frame_count()
+        for first in range(0, frame_count, frames_per_batch):
+            last = min(first + frames_per_batch, frame_count)
+            frames = self.get_frames(first, last)
+            yield first, scipy.fft.rfft(frames, axis=1, workers=self._workers)
+
+    def inverse(self, stft=None):
+        """
+        Samples back from the STFT (its own one by default),
+        see stream_istft().
+        """
+        if stft is None:
+            batches = self.stream()
+        else:
+            batches = [(0, stft)]
+        blocks = stream_istft(
+            batches,
+            self._frame_size,
+            self._hop,
+            self._window,
+            self._ogSignal.get_sample_count(),
+            self._workers,
+        )
+        return numpy.concatenate(list(blocks))
+
+    def partial_plot(self, max_frequency: float | None = None):
+        """
+        Integrates this spectrogram (amplitudes in dB) within a larger plot.
+        """
+        amplitudes = self.get_amplitudes()
+        frequencies = self.get_frequencies_axis()
+        if max_frequency is not None:
+            kept = frequencies <= max_frequency
+            frequencies = frequencies[kept]
+            amplitudes = amplitudes[:, kept]
+        plt.pcolormesh(
+            self.get_times_axis(),
+            frequencies,
+            20 * numpy.log10(amplitudes.T + numpy.finfo(float).tiny),
+            shading="nearest",
+            # One cell per frame and frequency, far too many for a vector image
+            rasterized=True,
+        )
+        plt.xlabel("Temps (s)")
+        plt.ylabel("Fréquence (Hz)")
+        plt.colorbar(label="Amplitude (dB)")
+
+    def full_plot(self, max_frequency: float | None = None, save: bool = True):
+        plt.figure()
+        self.partial_plot(max_frequency)
+        if save:
+            save_plot(f"stft_{self.get_signal().get_name()}")
+        plt.close()
+
+
+def stream_istft(
+    batches,
+    frame_size: int,
+    hop: int,
+    window,
+    length: int | None = None,
+    workers: int | None = None,
+):
+    """
+    Inverse STFT by weighted overlap-add, of the batches of spectra yielded
+    by SignalSTFT.stream() (in order). Yields the samples as soon as no later
+    frame overlaps them, so the memory stays bounded by a batch.
+
+    :param length: Amount of samples of the original signal, the padding
+        added at the end is removed.
+    """
+    window = numpy.asarray(window, dtype=numpy.float64)
+    overlaps = frame_size // hop
+    pad = frame_size // 2
+
+    # Sum of the frames and of the squared windows, hop samples per row,
+    # starting at the first sample not yielded yet (in the padded signal).
+    output = numpy.zeros((0, hop))
+    weights = numpy.zeros((0, hop))
+    offset = 0
+    position = -pad
+
+    def finished(rows):
+        nonlocal output, weights, offset, position
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            samples = numpy.where(
+                weights[:rows] > 1e-10, output[:rows] / weights[:rows], 0.0
+            ).reshape(-1)
+        output = output[rows:]
+        weights = weights[rows:]
+        offset += rows
+
+        # Drops the padding of the start, and of the end when length is known
+        skip = max(0, -position)
+        position += len(samples)
+        if length is not None:
+            samples = samples[: max(0, len(samples) - max(0, position - length))]
+        return samples[skip:]
+
+    for first, spectra in batches:
+        frames = scipy.fft.irfft(spectra, n=frame_size, axis=1, workers=workers)
+        frames *= window
+        frames = frames.reshape(len(frames), overlaps, hop)
+
+        needed = first - offset + len(frames) + overlaps - 1
+        if needed > len(output):
+            output = numpy.concatenate(
+                [output, numpy.zeros((needed - len(output), hop))]
+            )
+            weights = numpy.concatenate(
+                [weights, numpy.zeros((needed - len(weights), hop))]
+            )
+        squared = (window**2).reshape(overlaps, hop)
+        for part in range(overlaps):
+            start = first - offset + part
+            output[start : start + len(frames)] += frames[:, part]
+            weights[start : start + len(frames)] += squared[part]
+
+        # Rows before the next frame won't change anymore
+        samples = finished(first + len(frames) - offset)
+        if len(samples) > 0:
+            yield samples
+
+    samples = finished(len(output))
+    if len(samples) > 0:
+        yield samples
@@ -0,0 +1,141 @@
+import numpy
+
+# Samples produced by each block of the synthesizer.
+BLOCK_SIZE = 4096
+
+
+def stream_harmonics(
+    frequencies,
+    amplitudes,
+    phases,
+    envelope,
+    sampling_rate: int,
+    k: float = 1,
+    start: int = 0,
+    stop: int | None = None,
+    block_size: int = BLOCK_SIZE,
+):
+    """
+    Additive synthesis of the harmonics, one block of samples at a time.
+    Yields the samples between start and stop of:
+    $$
+    e[n] * \\sum_{i} A[i] * \\sin(2\\pi f_i k n / f_e + phase[i])
+    $$
+
+    Instead of evaluating sin() on a (harmonics x samples) matrix, each
+    harmonic is a complex oscillator: the block is its value at the start of
+    the block multiplied by a rotation table computed once. The start value
+    is recomputed exactly for every block, so no error builds up over time.
+    Memory used is O(block_size * harmonics) whatever the length.
+
+    :param envelope: Samples of the envelope, or an object computing them with
+        evaluate(start, stop) and get_length() (see code.envelope).
+        Samples past its end are silent. When stop isn't given,
+        the synthesis ends with the envelope.
+    """
+    frequencies = numpy.asarray(frequencies, dtype=numpy.float64)
+    amplitudes = numpy.asarray(amplitudes, dtype=numpy.float64)
+    phases = numpy.asarray(phases, dtype=numpy.float64)
+    if stop is None:
+        stop = envelope_length(envelope)
+
+    # Angle travelled by each harmonic between two samples
+    angular_steps = 2 * numpy.pi * frequencies * k / sampling_rate
+    rotations = numpy.exp(
+        1j * angular_steps[:, None] * numpy.arange(block_size)[None, :]
+    )
+
+    for block_start in range(start, stop, block_size):
+        block_stop = min(block_start + block_size, stop)
+        length = block_stop - block_start
+
+        oscillators = amplitudes * numpy.exp(
+            1j * (angular_steps * block_start + phases)
+        )
+        block = (oscillators @ rotations[:, :length]).imag
+
+        block *= envelope_samples(envelope, block_start, block_stop)
+        yield block
+
+
+def synthesize_harmonics(
+    frequencies,
+    amplitudes,
+    phases,
+    envelope,
+    sampling_rate: int,
+    k: float = 1,
+    start: int = 0,
+    stop: int | None = None,
+    block_size: int = BLOCK_SIZE,
+):
+    """
+    Same as stream_harmonics(), with every block gathered in one array.
+    """
+    blocks = list(
+        stream_harmonics(
+            frequencies,
+            amplitudes,
+            phases,
+            envelope,
+            sampling_rate,
+            k,
+            start,
+            stop,
+            block_size,
+        )
+    )
+    if len(blocks) == 0:
+        return numpy.zeros(0)
+    return numpy.concatenate(blocks)
+
+
+def harmonics_peak(
+    frequencies,
+    amplitudes,
+    phases,
+    envelope,
+    sampling_rate: int,
+    k: float = 1,
+    start: int = 0,
+    stop: int | None = None,
+    block_size: int = BLOCK_SIZE,
+):
+    """
+    Highest absolute value of the synthesized samples, without keeping them.
+    """
+    peak = 0.0
+    for block in stream_harmonics(
+        frequencies,
+        amplitudes,
+        phases,
+        envelope,
+        sampling_rate,
+        k,
+        start,
+        stop,
+        block_size,
+    ):
+        peak = max(peak, numpy.max(numpy.abs(block)))
+    return peak
+
+
+def envelope_length(envelope):
+    """
+    Amount of samples of an envelope, given as samples or as an object.
+    """
+    if hasattr(envelope, "evaluate"):
+        return envelope.get_length()
+    return len(envelope)
+
+
+def envelope_samples(envelope, start: int, stop: int):
+    """
+    Samples of an envelope between start and stop, silent past its end.
+    """
+    if hasattr(envelope, "evaluate"):
+        return envelope.evaluate(start, stop)
+    samples = numpy.zeros(stop - start)
+    available = envelope[start:stop]
+    samples[: len(available)] = available
+    return samples
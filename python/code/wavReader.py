@@ -0,0 +1,204 @@
+import struct
+from code.wavSignal import WavSignal
+from code.wavWriter import (
+    CHUNK_HEADER,
+    DS64,
+    FMT,
+    RF64_SIZE,
+    RIFF_HEADER,
+    WAVE_FORMAT_IEEE_FLOAT,
+    WAVE_FORMAT_PCM,
+)
+from pathlib import Path
+
+import numpy
+
+# Format of the files whose actual format is in the extension of fmt
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# Size of the extension, and where the actual format is in it (first two
+# bytes of the sub format GUID)
+EXTENSIBLE = struct.Struct("<HHIH")
+
+# Type of the samples read, by format and bits per sample. 24 bits samples are
+# read in the upper bytes of int32, like scipy.io.wavfile does.
+DTYPES = {
+    (WAVE_FORMAT_PCM, 8): numpy.dtype(numpy.uint8),
+    (WAVE_FORMAT_PCM, 16): numpy.dtype("<i2"),
+    (WAVE_FORMAT_PCM, 24): numpy.dtype("<i4"),
+    (WAVE_FORMAT_PCM, 32): numpy.dtype("<i4"),
+    (WAVE_FORMAT_IEEE_FLOAT, 32): numpy.dtype("<f4"),
+    (WAVE_FORMAT_IEEE_FLOAT, 64): numpy.dtype("<f8"),
+}
+
+
+class WavReader:
+    """
+    Reads a .wav file a few samples at a time, without ever decoding it all,
+    so recordings larger than the memory can be analysed.
+
+    Only the header is parsed on opening. RIFF and RF64 files are read, with
+    PCM samples of 8, 16, 24 or 32 bits or float samples of 32 or 64 bits,
+    in the plain or the extensible format.
+
+    Samples of several channels are returned as (samples x channels).
+    Use it in a with statement, or close() it.
+    """
+
+    def __init__(self, path):
+        self._path = Path(path)
+        self._name = self._path.stem
+        # Kept open until close(), the samples are read after __init__
+        self._file = open(self._path, "rb")  # noqa: SIM115
+        try:
+            self._parse_header()
+        except Exception:
+            self._file.close()
+            raise
+
+    # Getters
+    def get_path(self):
+        return self._path
+
+    def get_name(self):
+        return self._name
+
+    def get_sampling_rate(self):
+        return self._fs
+
+    def get_channels(self):
+        return self._channels
+
+    def get_bits(self):
+        return self._bits
+
+    def get_dtype(self):
+        return self._dtype
+
+    def get_frame_count(self):
+        """
+        Amount of samples (per channel)
+        """
+        return self._frame_count
+
+    def get_duration(self):
+        return self._frame_count / self._fs
+
+    def read(self, start: int = 0, count: int | None = None):
+        """
+        count samples from start (every sample after it by default),
+        fewer if the file ends before.
+        """
+        if start < 0:
+            raise ValueError(f"Can't read from sample {start}")
+        start = min(start, self._frame_count)
+        if count is None:
+            count = self._frame_count - start
+        count = max(0, min(count, self._frame_count - start))
+
+        raw = numpy.empty(count * self._block_align, dtype=numpy.uint8)
+        self._file.seek(self._data_offset + start * self._block_align)
+        read = self._file.readinto(raw)
+        if read != len(raw):
+            raise EOFError(f"{self._path} ends {len(raw) - read} bytes too soon")
+
+        if self._bits == 24:
+            # Each sample goes in the 3 upper bytes of an int32
+            samples = numpy.zeros((count * self._channels, 4), dtype=numpy.uint8)
+            samples[:, 1:] = raw.reshape(-1, 3)
+            samples = samples.view(self._dtype).reshape(-1)
+        else:
+            samples = raw.view(self._dtype)
+        samples = samples.astype(self._dtype.newbyteorder("="), copy=False)
+
+        if self._channels > 1:
+            return samples.reshape(count, self._channels)
+        return samples
+
+    def blocks(self, size: int, overlap: int = 0):
+        """
+        Yields blocks of size samples, each one starting overlap samples before
+        the end of the previous one. The last block is shorter when the file
+        doesn't end on a block. Only one block is in memory at a time.
+        """
+        if not 0 <= overlap < size:
+            raise ValueError(f"overlap ({overlap}) must be in [0, {size}[")
+        hop = size - overlap
+        start = 0
+        while start < self._frame_count:
+            yield self.read(start, size)
+            if start + size >= self._frame_count:
+                break
+            start += hop
+
+    def get_signal(self, start: int = 0, count: int | None = None):
+        """
+        WavSignal of count samples from start, to use the rest of the
+        analysis on a part of the file.
+        """
+        return WavSignal.from_array(
+            self._name, self._fs, self.read(start, count), str(self._path), self._dtype
+        )
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def _parse_header(self):
+        riff, _, wave = RIFF_HEADER.unpack(self._read_exactly(RIFF_HEADER.size))
+        if riff not in (b"RIFF", b"RF64") or wave != b"WAVE":
+            raise ValueError(f"{self._path} isn't a .wav file")
+
+        file_size = self._path.stat().st_size
+        data_size = None
+        fmt = None
+        while True:
+            header = self._file.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                raise ValueError(f"{self._path} has no data chunk")
+            chunk, size = CHUNK_HEADER.unpack(header)
+            offset = self._file.tell()
+
+            if chunk == b"ds64":
+                _, data_size, _, _ = DS64.unpack(self._read_exactly(DS64.size))
+            elif chunk == b"fmt ":
+                fmt = self._read_exactly(size)
+            elif chunk == b"data":
+                if size != RF64_SIZE:
+                    data_size = size
+                elif data_size is None:
+                    # Size left unknown by a stream, the data goes on to the end
+                    data_size = file_size - offset
+                self._data_offset = offset
+                break
+            self._file.seek(offset + size + size % 2)
+
+        if fmt is None:
+            raise ValueError(f"{self._path} has no fmt chunk before its data")
+        format_tag, self._channels, self._fs, _, self._block_align, self._bits = (
+            FMT.unpack(fmt[: FMT.size])
+        )
+        if format_tag == WAVE_FORMAT_EXTENSIBLE:
+            _, _, _, format_tag = EXTENSIBLE.unpack(
+                fmt[FMT.size : FMT.size + EXTENSIBLE.size]
+            )
+
+        if (format_tag, self._bits) not in DTYPES:
+            raise ValueError(
+                f"{self._path}: format {format_tag} with {self._bits} bits "
+                "per sample isn't supported"
+            )
+        self._dtype = DTYPES[(format_tag, self._bits)]
+        # Samples cut by the end of a truncated file are left out
+        available = max(0, file_size - self._data_offset)
+        self._frame_count = min(data_size, available) // self._block_align
+
+    def _read_exactly(self, size: int):
+        data = self._file.read(size)
+        if len(data) != size:
+            raise ValueError(f"{self._path} ends in its header")
+        return data
@@ -1,4 +1,7 @@
+from code.decimation import PLOT_RESOLUTION, decimate_for_plot
+from code.dtypePolicy import OUTPUT_DTYPE, get_processing_dtype_for
 from code.saveFigure import save_plot
+from code.wavWriter import array_blocks, write_wav
 from pathlib import Path
 
 import matplotlib.pyplot as plt
@@ -12,20 +15,85 @@ class WavSignal:
     Instanciate it with the path to a .wav signal.
     You'll then be able to obtain the duration, amount of samples
     and perform other tasks to the signal.
+
+    The samples read are converted once to the processing type (see
+    code.dtypePolicy), float64 for 24 and 32 bits files, without being
+    rescaled. save() writes them back in the type of the file they come
+    from, so a signal loaded and saved is unchanged whatever its format.
+
+    With mmap=True, the samples are memory-mapped instead of read, and kept
+    in the type of the file. Only the header is parsed on opening, so the
+    sampling rate, N and the duration are available without touching the
+    samples themselves. The time axis is never stored, it's built when
+    asked for.
     """
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, mmap: bool = False):
         self._path = path
         self._name = Path(self._path).stem
-        self._fs, self._signal = wavfile.read(path)
+        self._fs, self._signal = wavfile.read(path, mmap=mmap)
+        self._file_dtype = self._signal.dtype
+        if not mmap:
+            self._signal = self._signal.astype(
+                get_processing_dtype_for(self._file_dtype), copy=False
+            )
         self._N = len(self._signal)
-        self._t = np.arange(self._N) / self._fs
 
-    def save(self):
-        wavfile.write(
-            f"audio/{self.get_name()}.wav", self.get_sampling_rate(), self.get_signal()
+    @classmethod
+    def from_array(
+        cls, name: str, sampling_rate: int, signal, path: str = "", file_dtype=None
+    ):
+        """
+        Builds a WavSignal from samples already in memory,
+        without reading any file.
+
+        :param file_dtype: Type of the samples written by save(). By default
+            the type of integer samples, 16 bits for float ones.
+        """
+        new_signal = cls.__new__(cls)
+        new_signal._path = path
+        new_signal._name = name
+        new_signal._fs = sampling_rate
+        new_signal.set_signal(signal)
+        if file_dtype is None:
+            samples = np.asarray(signal)
+            integer = np.issubdtype(samples.dtype, np.integer)
+            file_dtype = samples.dtype if integer else OUTPUT_DTYPE
+        new_signal._file_dtype = np.dtype(file_dtype)
+        return new_signal
+
+    def view(self):
+        """
+        Cheap copy of this WavSignal sharing the same samples, read-only.
+        Use set_signal() on the view to modify it, the samples
+        of this WavSignal stay untouched.
+        """
+        samples = self.get_signal().view()
+        samples.flags.writeable = False
+        return WavSignal.from_array(
+            self.get_name(),
+            self.get_sampling_rate(),
+            samples,
+            self.get_path(),
+            self.get_file_dtype(),
         )
 
+    def save(self, directory: str = "audio"):
+        """
+        Writes the samples in directory/name.wav, block by block
+        (see WavWriter), so a memory-mapped signal is never read at once.
+        They're written in get_file_dtype(): float samples going to an integer
+        file are dithered (see to_output()).
+        """
+        path = Path(directory) / f"{self.get_name()}.wav"
+        write_wav(
+            path,
+            self.get_sampling_rate(),
+            array_blocks(self.get_signal()),
+            self.get_file_dtype(),
+        )
+        return path
+
     # Setters
     def set_name(self, name: str):
         self._name = name
@@ -36,7 +104,6 @@ class WavSignal:
         """
         self._signal = newSignal
         self._N = len(self._signal)
-        self._t = np.arange(self._N) / self._fs
 
     # Getters
     def get_sampling_rate(self):
@@ -51,8 +118,17 @@ class WavSignal:
     def get_signal(self):
         return self._signal
 
-    def get_time_axis(self):
-        return self._t
+    def get_time_axis(self, start: int = 0, stop: int | None = None):
+        """
+        Time (in seconds) of each sample between start and stop.
+        Computed on demand so only the asked slice is ever allocated.
+        """
+        if stop is None:
+            stop = self.get_sample_count()
+        return np.arange(start, stop) / self.get_sampling_rate()
+
+    def is_memory_mapped(self):
+        return isinstance(self._signal, np.memmap)
 
     def get_sample_count(self):
         return self._N
@@ -60,6 +136,12 @@ class WavSignal:
     def get_path(self):
         return self._path
 
+    def get_file_dtype(self):
+        """
+        Type of the samples in the file, the one save() writes
+        """
+        return self._file_dtype
+
     def get_name(self):
         return self._name
 
@@ -71,7 +153,7 @@ class WavSignal:
         print(f"\t- Signal:      {self.get_signal()}")
         print(f"\t- Time:        {self.get_time_axis()}")
 
-    def partial_plot(self):
+    def partial_plot(self, resolution: int = PLOT_RESOLUTION):
         """
         Integrates this signal within a larger plot.
         You handle the business, but this essentially
@@ -79,8 +161,10 @@ class WavSignal:
         with the getters.
 
         Does not apply a title.
+        The signal is decimated to the resolution (None to plot every sample).
         """
-        plt.plot(self.get_time_axis(), self.get_signal(), label=self.get_name())
+        indexes, samples = decimate_for_plot(None, self.get_signal(), resolution)
+        plt.plot(indexes / self.get_sampling_rate(), samples, label=self.get_name())
         plt.xlabel("Temps (s)")
         plt.ylabel("Amplitude")
         plt.legend()
@@ -0,0 +1,220 @@
+import struct
+from code.dtypePolicy import DITHER_SEED, OUTPUT_DTYPE, to_output
+from pathlib import Path
+
+import numpy
+
+# Layout of the header written before the samples: the RIFF header, a JUNK
+# chunk holding the place of the ds64 chunk of RF64, the fmt chunk, a fact
+# chunk for float samples, then the header of the data chunk.
+# The sizes are unknown until the last block, they're patched on close.
+RIFF_HEADER = struct.Struct("<4sI4s")
+CHUNK_HEADER = struct.Struct("<4sI")
+FMT = struct.Struct("<HHIIHH")
+DS64 = struct.Struct("<QQQI")
+FACT = struct.Struct("<I")
+
+# Size fields of 32 bits, set to this when the real size is in the ds64 chunk
+RF64_SIZE = 0xFFFFFFFF
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+# Sample types which can be written, the same as scipy.io.wavfile
+FORMATS = {
+    numpy.dtype(numpy.uint8): WAVE_FORMAT_PCM,
+    numpy.dtype(numpy.int16): WAVE_FORMAT_PCM,
+    numpy.dtype(numpy.int32): WAVE_FORMAT_PCM,
+    numpy.dtype(numpy.float32): WAVE_FORMAT_IEEE_FLOAT,
+    numpy.dtype(numpy.float64): WAVE_FORMAT_IEEE_FLOAT,
+}
+
+# Samples written at once when saving an array already in memory.
+WRITE_BLOCK_SIZE = 1 << 16
+
+
+class WavWriter:
+    """
+    Writes a .wav file block by block, so the whole signal never has to be
+    in memory. The sizes in the header are only known at the end: they're
+    patched by close(), so the file is incomplete until then (use it in a
+    with statement).
+
+    When the file ends up larger than 4 GiB, it becomes an RF64 file, the
+    place for the 64 bits sizes being reserved at the start of every file.
+    Small files stay plain .wav files that any reader opens.
+
+    :param dtype: Type of the samples in the file. Float blocks written in an
+        integer file are dithered and clipped (see to_output()), other
+        blocks are converted like numpy.astype() would.
+    :param channels: Blocks of several channels are (samples x channels).
+    :param rf64: Always write an RF64 file, even a small one.
+    """
+
+    def __init__(
+        self,
+        path,
+        sampling_rate: int,
+        dtype=OUTPUT_DTYPE,
+        channels: int = 1,
+        rf64: bool = False,
+    ):
+        self._dtype = numpy.dtype(dtype)
+        if self._dtype not in FORMATS:
+            raise ValueError(f"Can't write samples of type {self._dtype}")
+        self._path = Path(path)
+        self._sampling_rate = sampling_rate
+        self._channels = channels
+        self._rf64 = rf64
+        self._frame_count = 0
+        self._dither = numpy.random.default_rng(DITHER_SEED)
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        # Kept open until close(), the blocks come after __init__
+        self._file = open(self._path, "wb")  # noqa: SIM115
+        try:
+            self._write_header()
+        except Exception:
+            self._file.close()
+            raise
+
+    # Getters
+    def get_path(self):
+        return self._path
+
+    def get_sampling_rate(self):
+        return self._sampling_rate
+
+    def get_dtype(self):
+        return self._dtype
+
+    def get_channels(self):
+        return self._channels
+
+    def get_frame_count(self):
+        """
+        Amount of samples written so far (per channel)
+        """
+        return self._frame_count
+
+    def is_closed(self):
+        return self._file.closed
+
+    def write(self, block):
+        """
+        Appends the samples of the block to the file.
+        """
+        samples = numpy.asarray(block)
+        if samples.ndim == 1:
+            samples = samples.reshape(-1, 1)
+        if samples.shape[1] != self._channels:
+            raise ValueError(
+                f"Blocks of {samples.shape[1]} channels given to a file of "
+                f"{self._channels}"
+            )
+        if numpy.issubdtype(self._dtype, numpy.integer):
+            samples = to_output(samples, self._dtype, self._dither)
+        samples = samples.astype(self._dtype.newbyteorder("<"), copy=False)
+        self._file.write(numpy.ascontiguousarray(samples).data)
+        self._frame_count += len(samples)
+
+    def write_blocks(self, blocks):
+        """
+        Appends every block of an iterable, a generator of the synthesizer
+        for instance, holding only one of them at a time.
+        """
+        for block in blocks:
+            self.write(block)
+
+    def close(self):
+        """
+        Patches the sizes in the header and closes the file.
+        """
+        if self._file.closed:
+            return
+        data_size = self._frame_count * self._channels * self._dtype.itemsize
+        # Chunks start on even bytes
+        if data_size % 2 == 1:
+            self._file.write(b"\0")
+        riff_size = self._file.tell() - CHUNK_HEADER.size
+
+        rf64 = self._rf64 or riff_size > RF64_SIZE or data_size > RF64_SIZE
+        if rf64:
+            self._file.seek(0)
+            self._file.write(RIFF_HEADER.pack(b"RF64", RF64_SIZE, b"WAVE"))
+            self._file.write(CHUNK_HEADER.pack(b"ds64", DS64.size))
+            self._file.write(DS64.pack(riff_size, data_size, self._frame_count, 0))
+        else:
+            self._file.seek(0)
+            self._file.write(RIFF_HEADER.pack(b"RIFF", riff_size, b"WAVE"))
+
+        if self._fact_offset is not None:
+            self._file.seek(self._fact_offset)
+            self._file.write(FACT.pack(RF64_SIZE if rf64 else self._frame_count))
+        self._file.seek(self._data_offset)
+        self._file.write(CHUNK_HEADER.pack(b"data", RF64_SIZE if rf64 else data_size))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def _write_header(self):
+        file = self._file
+        file.write(RIFF_HEADER.pack(b"RIFF", 0, b"WAVE"))
+        file.write(CHUNK_HEADER.pack(b"JUNK", DS64.size))
+        file.write(bytes(DS64.size))
+
+        bits = self._dtype.itemsize * 8
+        block_align = self._channels * self._dtype.itemsize
+        file.write(CHUNK_HEADER.pack(b"fmt ", FMT.size))
+        file.write(
+            FMT.pack(
+                FORMATS[self._dtype],
+                self._channels,
+                self._sampling_rate,
+                self._sampling_rate * block_align,
+                block_align,
+                bits,
+            )
+        )
+
+        self._fact_offset = None
+        if FORMATS[self._dtype] != WAVE_FORMAT_PCM:
+            file.write(CHUNK_HEADER.pack(b"fact", FACT.size))
+            self._fact_offset = file.tell()
+            file.write(FACT.pack(0))
+
+        self._data_offset = file.tell()
+        file.write(CHUNK_HEADER.pack(b"data", 0))
+
+
+def write_wav(path, sampling_rate: int, blocks, dtype=OUTPUT_DTYPE, rf64: bool = False):
+    """
+    Writes every block of an iterable in a .wav file, see WavWriter.
+    The amount of channels is the one of the first block.
+
+    :return: Amount of samples written (per channel)
+    """
+    blocks = iter(blocks)
+    first = next(blocks, None)
+    if first is None:
+        first = numpy.zeros(0, dtype=dtype)
+    first = numpy.asarray(first)
+    channels = 1 if first.ndim == 1 else first.shape[1]
+
+    with WavWriter(path, sampling_rate, dtype, channels, rf64) as writer:
+        writer.write(first)
+        writer.write_blocks(blocks)
+    return writer.get_frame_count()
+
+
+def array_blocks(samples, block_size: int = WRITE_BLOCK_SIZE):
+    """
+    Blocks of block_size samples of an array, as views. With a memory-mapped
+    array, only one block is read from the disk at a time.
+    """
+    for start in range(0, len(samples), block_size):
+        yield samples[start : start + block_size]
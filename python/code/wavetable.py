@@ -0,0 +1,146 @@
+from code.dtypePolicy import get_processing_dtype
+from code.synthesizer import BLOCK_SIZE, envelope_length, envelope_samples
+
+import numpy
+
+# Samples of one cycle of a wavetable, a power of 2. Reading the closest sample
+# without interpolating, the error stays around -74 dB of the note, in a table
+# of 256 kiB (in float32) small enough to stay in the cache.
+WAVETABLE_SIZE = 1 << 16
+
+# Bits of the position in the cycle: a whole cycle is 2**64, so the position
+# of a sample wraps around by itself when it's multiplied in uint64.
+PHASE_BITS = 64
+
+
+class Wavetable:
+    """
+    Single cycle of an instrument, computed once from its harmonics,
+    then played at any pitch by reading it at a fractional speed.
+
+    Each harmonic is placed on the closest multiple of the fundamental, so the
+    slight inharmonicity of a real string is lost. In exchange, a sample costs
+    one lookup instead of one oscillator per harmonic: the table is large
+    enough to read the closest sample rather than interpolating.
+    """
+
+    def __init__(
+        self,
+        frequencies,
+        amplitudes,
+        phases,
+        fundamental: float,
+        size: int = WAVETABLE_SIZE,
+    ):
+        if size < 2 or size & (size - 1) != 0:
+            raise ValueError(
+                f"The size of a wavetable must be a power of 2, not {size}"
+            )
+        self._fundamental = fundamental
+        self._size = size
+        self._amplitudes = numpy.asarray(amplitudes, dtype=numpy.float64)
+        self._phases = numpy.asarray(phases, dtype=numpy.float64)
+        self._harmonic_numbers = numpy.maximum(
+            numpy.round(numpy.asarray(frequencies) / fundamental), 1
+        ).astype(numpy.int64)
+        # Tables already built, by highest harmonic kept
+        self._tables = {}
+
+    def get_fundamental(self):
+        return self._fundamental
+
+    def get_size(self):
+        return self._size
+
+    def get_harmonic_numbers(self):
+        return self._harmonic_numbers
+
+    def get_table(self, k: float = 1, sampling_rate: int | None = None):
+        """
+        Band-limited cycle for a pitch of k times the fundamental: harmonics
+        above the Nyquist frequency at that pitch are left out, they would
+        fold back as aliasing. In the processing type (see code.dtypePolicy).
+        """
+        kept = self._harmonic_numbers
+        if sampling_rate is not None:
+            kept = kept[kept * self._fundamental * k < sampling_rate / 2]
+        highest = int(kept.max()) if len(kept) > 0 else 0
+
+        if highest not in self._tables:
+            keep = self._harmonic_numbers <= highest
+            # Same sum as the additive synthesis, through an inverse FFT
+            spectrum = numpy.zeros(self._size // 2 + 1, dtype=numpy.complex128)
+            numpy.add.at(
+                spectrum,
+                self._harmonic_numbers[keep],
+                self._amplitudes[keep]
+                * numpy.exp(1j * (self._phases[keep] - numpy.pi / 2)),
+            )
+            cycle = numpy.fft.irfft(spectrum, self._size) * self._size / 2
+            self._tables[highest] = cycle.astype(get_processing_dtype())
+        return self._tables[highest]
+
+    def stream(
+        self,
+        envelope,
+        sampling_rate: int,
+        k: float = 1,
+        start: int = 0,
+        stop: int | None = None,
+        block_size: int = BLOCK_SIZE,
+    ):
+        """
+        Same blocks as stream_harmonics(), read from the table.
+        The position in the cycle is computed from the index of each sample,
+        in fixed point on 64 bits, so no error builds up over time.
+        """
+        if stop is None:
+            stop = envelope_length(envelope)
+        table = self.get_table(k, sampling_rate)
+        cycles_per_sample = (self._fundamental * k / sampling_rate) % 1
+        step = numpy.uint64(round(cycles_per_sample * 2**PHASE_BITS) % 2**PHASE_BITS)
+        # The highest bits of the position are the index in the table
+        shift = numpy.uint64(PHASE_BITS - self._size.bit_length() + 1)
+
+        for block_start in range(start, stop, block_size):
+            block_stop = min(block_start + block_size, stop)
+            position = numpy.arange(block_start, block_stop, dtype=numpy.uint64)
+            position *= step
+            position >>= shift
+            block = table.take(position.view(numpy.int64))
+            block *= envelope_samples(envelope, block_start, block_stop)
+            yield block
+
+    def synthesize(
+        self,
+        envelope,
+        sampling_rate: int,
+        k: float = 1,
+        start: int = 0,
+        stop: int | None = None,
+        block_size: int = BLOCK_SIZE,
+    ):
+        """
+        Same as stream(), with every block gathered in one array.
+        """
+        blocks = list(self.stream(envelope, sampling_rate, k, start, stop, block_size))
+        if len(blocks) == 0:
+            return numpy.zeros(0, dtype=get_processing_dtype())
+        return numpy.concatenate(blocks)
+
+    def peak(
+        self,
+        envelope,
+        sampling_rate: int,
+        k: float = 1,
+        start: int = 0,
+        stop: int | None = None,
+        block_size: int = BLOCK_SIZE,
+    ):
+        """
+        Highest absolute value of the synthesized samples, without keeping them.
+        """
+        peak = 0.0
+        for block in self.stream(envelope, sampling_rate, k, start, stop, block_size):
+            peak = max(peak, numpy.max(numpy.abs(block)))
+        return peak
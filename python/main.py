@@ -1,5 +1,6 @@
 from code.guitar import execute_guitar
 from code.rawSignals import plot_raw_signals
+from code.saveFigure import wait_for_plots
 import matplotlib.pyplot as plt
 
 # from code.sandbox import sandbox
@@ -16,6 +17,7 @@ def main():
     plot_raw_signals()
     # sandbox()
     execute_guitar()
+    wait_for_plots()
 
 
 if __name__ == "__main__":